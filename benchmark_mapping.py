@@ -0,0 +1,160 @@
+# benchmark_mapping.py
+# Otomatik eşleştirmenin (BWAParser.run_mapping = perform_mapping'in arayüzsüz kısmı) uçtan uca süresini
+# ve AI öneri verimini yerel test sunucusuna (mock_claude_server.py) karşı ölçer.
+# Eşzamanlılık, toplu istek ve önbellek iyileştirmelerini internetsiz karşılaştırmak için.
+#
+# Kullanım:
+#   python benchmark_mapping.py --accounts 40 --latency 0.8 --rate-429 0.1
+#   python benchmark_mapping.py --bwa kunde.xlsx --url http://127.0.0.1:8765/v1/messages
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import openpyxl
+import requests
+
+import form_doldurucu as app
+import mock_claude_server
+
+BENCHMARK_DESCRIPTIONS = ["Fremdleistungen", "Versicherungen", "Beiträge", "Fortbildungskosten", "Fachliteratur",
+                          "Leasing", "Wartung", "Software", "Rechtsberatung", "Kfz-Kosten", "Werbekosten"]
+
+
+def create_synthetic_bwa(path: str, accounts: int, seed: int = 1):
+    """Bilinen hesaplar + 'accounts' adet eşleştirilmemiş hesap içeren 12 aylık bir BWA üretir"""
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["BWA Jahresübersicht"])
+    ws.append(["12345 Benchmark GmbH"])
+    ws.append([])
+    ws.append(["Konto / Bezeichnung"] + app.MONTH_COLS)
+    known = ["4400 Erlöse 19% USt", "5400 Wareneingang 19%", "6310 Miete", "6805 Telefon", "6855 Nebenkosten des Geldverkehrs"]
+    for text in known:
+        ws.append([text] + [round(rng.uniform(100, 5000), 2) for _ in app.MONTH_COLS])
+    for i in range(accounts):
+        text = f"{7000 + i} {rng.choice(BENCHMARK_DESCRIPTIONS)} {i}"
+        ws.append([text] + [round(rng.uniform(100, 5000), 2) for _ in app.MONTH_COLS])
+    wb.save(path)
+
+
+def server_stats(url: str) -> dict:
+    """Mock sunucunun /stats sayaçları (gerçek API'de yok)"""
+    try:
+        return requests.get(url.replace("/v1/messages", "/stats"), timeout=2).json()
+    except Exception:
+        return {}
+
+
+def measure(label: str, func, url: str, verbose: bool):
+    before = server_stats(url)
+    output = io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output) if not verbose else contextlib.nullcontext():
+        result = func()
+    elapsed = time.perf_counter() - started
+    after = server_stats(url)
+    requests_made = after.get("requests", 0) - before.get("requests", 0)
+    rate_limited = after.get("rate_limited", 0) - before.get("rate_limited", 0)
+    return label, elapsed, result, requests_made, rate_limited
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Eşleştirme / AI öneri yolu benchmark'ı")
+    parser.add_argument("--bwa", help="Ölçülecek BWA dosyası (yoksa sentetik BWA üretilir)")
+    parser.add_argument("--accounts", type=int, default=40, help="Sentetik BWA'daki ve AI'ya sorulacak hesap sayısı")
+    parser.add_argument("--url", help="Çalışan bir mock sunucu; verilmezse gömülü sunucu başlatılır")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--runs", type=int, default=3, help="run_mapping tekrarı (ilki soğuk önbellek)")
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--deadline", type=float, default=20.0)
+    parser.add_argument("--rate", type=float, default=10.0, help="İstemci token bucket hızı (istek/s)")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--no-local", action="store_true", help="Yerel öneri motorunu atla (her hesap AI'ya gider)")
+    parser.add_argument("--start", default="JAN")
+    parser.add_argument("--end", default="DEZ")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    bwa_path = os.path.abspath(args.bwa) if args.bwa else None
+    # Önbellekler ve kabul edilen eşleştirmeler her çalıştırmada temiz bir klasörde başlar
+    workdir = tempfile.mkdtemp(prefix="eks_benchmark_")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+
+    server = None
+    url = args.url
+    if not url:
+        settings = mock_claude_server.MockSettings(args.latency, args.jitter, args.error_rate,
+                                                   args.rate_429, args.retry_after, seed=1)
+        server = mock_claude_server.start_server(args.port, settings)
+        url = f"http://127.0.0.1:{server.server_port}/v1/messages"
+
+    try:
+        if not bwa_path:
+            bwa_path = os.path.join(workdir, "benchmark_bwa.xlsx")
+            create_synthetic_bwa(bwa_path, args.accounts)
+
+        bwa_parser = app.BWAParser()
+        with contextlib.redirect_stdout(io.StringIO()):
+            success, message = bwa_parser.load_bwa_file(bwa_path)
+        if not success:
+            print(f"BWA konnte nicht geladen werden: {message}")
+            return
+        bwa_parser.unmapped_top_k = args.accounts
+        bwa_parser.ai_max_in_flight = args.max_in_flight
+        bwa_parser.ai_deadline = args.deadline
+        if args.no_local:
+            bwa_parser.local_confidence_threshold = 101
+
+        def make_helper(cache_name: str) -> app.ClaudeAPIHelper:
+            return app.ClaudeAPIHelper(
+                "sk-ant-benchmark-key",
+                cache=app.AISuggestionCache(os.path.join(workdir, cache_name)),
+                http_client=app.ClaudeHTTPClient(rate_per_second=args.rate, burst=args.burst),
+                base_url=url
+            )
+
+        print(f"Endpoint: {url}")
+        print(f"BWA: {os.path.basename(bwa_path)} ({len(bwa_parser.bwa_data)} Zeilen), Konten für Vorschläge: {args.accounts}")
+        print(f"{'Lauf':<28}{'Zeit (s)':>10}{'Vorschläge':>12}{'Vorschl./s':>12}{'Requests':>10}{'429':>6}")
+
+        rows = []
+        bwa_parser.claude_api = make_helper("ai_suggestions.json")
+        for run in range(args.runs):
+            label = "run_mapping (kalt)" if run == 0 else f"run_mapping (warm #{run})"
+            rows.append(measure(label, lambda: bwa_parser.run_mapping(args.start, args.end), url, args.verbose))
+
+        # Karşılaştırma: önbelleksiz, hesap başına ayrı istekler (toplu istek olmadan)
+        bwa_parser.claude_api = make_helper("ai_suggestions_individual.json")
+        with contextlib.redirect_stdout(io.StringIO()):
+            unmapped = bwa_parser._find_unmapped_accounts()
+        rows.append(measure("einzeln (ohne Batch/Cache)", lambda: bwa_parser._suggest_individually(unmapped),
+                            url, args.verbose))
+
+        for label, elapsed, result, requests_made, rate_limited in rows:
+            if isinstance(result, dict):
+                count = len(result.get('_ai_suggestions', []))
+            else:
+                count = sum(1 for entry in result if entry and entry.get('suggestion'))
+            throughput = count / elapsed if elapsed > 0 else 0.0
+            print(f"{label:<28}{elapsed:>10.3f}{count:>12}{throughput:>12.1f}{requests_made:>10}{rate_limited:>6}")
+    finally:
+        if server:
+            server.shutdown()
+        os.chdir(previous_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,33 @@
 import customtkinter as ctk
 import pandas as pd
+import numpy as np
 import json
 import os
 from datetime import datetime, timedelta
 from tkinter import filedialog, messagebox
 from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass, asdict, field
+from dataclasses import dataclass, asdict, field, replace
 import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment
 import requests
+import email.utils
+import random
 import threading
+import time
+import itertools
+import bisect
+import difflib
 import re
 import sys
 import tempfile
 import base64
+import io
+import zlib
+import hashlib
+import sqlite3
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from types import MappingProxyType
 import template_data # Az önce oluşturduğumuz dosyayı import ediyoruz
 import sys
 import os
@@ -28,6 +42,16 @@ if getattr(sys, 'frozen', False):
 
 APP_VERSION = "v1.0.0"
 
+DEFAULT_CLAUDE_API_URL = "https://api.anthropic.com/v1/messages"
+
+MONTH_COLS = ['JAN', 'FEB', 'MRZ', 'APR', 'MAI', 'JUN', 'JUL', 'AUG', 'SEP', 'OKT', 'NOV', 'DEZ']
+
+# Danışmanların düzenli olarak ihtiyaç duyduğu standart dönemler
+STANDARD_PERIODS = {
+    'Q1': ('JAN', 'MRZ'), 'Q2': ('APR', 'JUN'), 'Q3': ('JUL', 'SEP'), 'Q4': ('OKT', 'DEZ'),
+    'H1': ('JAN', 'JUN'), 'H2': ('JUL', 'DEZ'), 'Jahr': ('JAN', 'DEZ'),
+}
+
 
 def resource_path(relative_path):
     """ Geliştirme ve PyInstaller için kaynaklara mutlak yol alır """
@@ -48,6 +72,7 @@ LANGUAGES = {
         "template": "Vorlage", 
         "load_bwa": "BWA Datei laden",
         "auto_mapping": "Automatische Zuordnung",
+        "account_rule": "📐 Kontenbereich-Regel",
         "export_eks": "EKS Exportieren",
         "new_customer": "Neuer Kunde",
         "customer_code": "Kundennummer",
@@ -90,6 +115,7 @@ LANGUAGES = {
         "template": "Şablon",
         "load_bwa": "BWA Dosyası Yükle",
         "auto_mapping": "Otomatik Eşleştirme",
+        "account_rule": "📐 Hesap Aralığı Kuralı",
         "export_eks": "EKS Dışa Aktar",
         "new_customer": "Yeni Müşteri",
         "customer_code": "Müşteri Kodu",
@@ -144,33 +170,213 @@ class MappingRule:
     calculation_type: str  # 'direct', 'sum'
     source_accounts: List[str] = None
     description_de: str = ""
+    account_ranges: List[Tuple[str, str]] = None  # [("6300", "6399")] - iki uç dahil
+    account_prefixes: List[str] = None  # ["63"] - "63" ile başlayan tüm hesaplar
+    
+    def __post_init__(self):
+        # Aralık/önek uçları sadece rakam olabilir; hatalı kural hesaplamaya girmeden burada reddedilir
+        ranges = []
+        for bounds in self.account_ranges or []:
+            if isinstance(bounds, str) or len(bounds) != 2:
+                raise ValueError(f"Ungültiger Kontenbereich: {bounds}")
+            low, high = (str(bound).strip() for bound in bounds)
+            if not (re.fullmatch(r'[0-9]{1,18}', low) and re.fullmatch(r'[0-9]{1,18}', high)) or int(low) > int(high):
+                raise ValueError(f"Ungültiger Kontenbereich: {low}-{high}")
+            ranges.append((low, high))
+        prefixes = [str(prefix).strip() for prefix in self.account_prefixes or []]
+        for prefix in prefixes:
+            if not re.fullmatch(r'[0-9]{1,18}', prefix):
+                raise ValueError(f"Ungültiges Kontenpräfix: {prefix}")
+        self.account_ranges = ranges or None
+        self.account_prefixes = prefixes or None
 
-class ClaudeAPIHelper:
-    """Claude API entegrasyonu için yardımcı sınıf"""
+class AISuggestionCache:
+    """AI eşleştirme önerilerini müşteriler arası paylaşılan bir JSON dosyasında saklar (TTL, LRU, boyut sınırlı)"""
     
-    def __init__(self, api_key: str = None):
-        self.api_key = api_key
-        self.base_url = "https://api.anthropic.com/v1/messages"
-        
-    def is_available(self) -> bool:
-        """API kullanılabilir mi kontrol eder"""
-        return bool(self.api_key and len(self.api_key) > 10)
+    def __init__(self, cache_path: str = os.path.join("data", "cache", "ai_suggestions.json"),
+                 ttl_days: float = 90, negative_ttl_days: float = 7, max_entries: int = 5000):
+        self.cache_path = cache_path
+        self.ttl = ttl_days * 86400
+        self.negative_ttl = negative_ttl_days * 86400
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = None  # İlk kullanımda diskten yüklenir
+        self._dirty = False
+        self._lock = threading.Lock()
     
-    def suggest_mapping(self, account_code: str, description: str, bwa_context: str = "") -> Dict:
-        """Bilinmeyen hesap kodu için EKS eşleştirme önerisi"""
-        if not self.is_available():
-            return {"suggestion": None, "confidence": 0, "reason": "API key not available"}
-        
+    @staticmethod
+    def make_key(account_code: str, description: str, model: str, prompt_version: int) -> str:
+        """Normalleştirilmiş hesap kodu + açıklama + model/istem sürümü"""
+        code = str(account_code).strip()
+        if re.fullmatch(r'\d+(\.0+)?', code):
+            code = code.split('.')[0].lstrip('0') or '0'
+        description = " ".join(str(description or "").casefold().split())
+        return f"v{prompt_version}|{model}|{code}|{description}"
+    
+    def _load(self):
+        if self._entries is not None:
+            return
         try:
-            prompt = f"""Du bist ein Experte für deutsche Buchführung und EKS-Formulare.
-
-BWA Hesap Kodu: {account_code}
-Beschreibung: {description}
-Kontext: {bwa_context}
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+        except Exception as e:
+            print(f"AI suggestion cache unreadable, starting empty: {e}")
+            self._entries = {}
+    
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            now = time.time()
+            if entry is not None:
+                ttl = self.ttl if entry['result'].get('suggestion') else self.negative_ttl
+                if now - entry['created'] > ttl:
+                    del self._entries[key]
+                    self._dirty = True
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            # Son kullanım sadece bellekte güncellenir; diske bir sonraki gerçek yazımda gider
+            entry['used'] = now
+            self.hits += 1
+            return dict(entry['result'])
+    
+    def put(self, key: str, result: Dict):
+        """Başarılı bir API yanıtını saklar ("öneri yok" yanıtları dahil, hatalar hariç)"""
+        with self._lock:
+            self._load()
+            now = time.time()
+            self._entries[key] = {'result': dict(result), 'created': now, 'used': now}
+            self._dirty = True
+            if len(self._entries) > self.max_entries:
+                # En uzun süredir kullanılmayanları at
+                for old_key, _ in sorted(self._entries.items(), key=lambda item: item[1]['used'])[:len(self._entries) - self.max_entries]:
+                    del self._entries[old_key]
+    
+    def save(self):
+        """Değişiklik varsa dosyaya atomik olarak yazar"""
+        with self._lock:
+            if not self._dirty or self._entries is None:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+                tmp_path = self.cache_path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.cache_path)
+                self._dirty = False
+            except Exception as e:
+                print(f"AI suggestion cache write error: {e}")
+    
+    def stats(self) -> Dict:
+        """Önbellek isabet/ıska sayıları"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0
+            }
 
-Welches EKS-Feld passt am besten zu diesem BWA-Konto? 
+class ClaudeHTTPClient:
+    """Claude API için paylaşılan HTTP katmanı: bağlantı havuzu (keep-alive), token bucket ve yeniden deneme"""
+    
+    RETRY_STATUSES = (429, 500, 502, 503, 504, 529)
+    _shared = None
+    _shared_lock = threading.Lock()
+    
+    def __init__(self, rate_per_second: float = 2.0, burst: int = 4, max_retries: int = 3,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0, pool_size: int = 8):
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def shared(cls) -> 'ClaudeHTTPClient':
+        """Uygulama genelinde tek istemci (bağlantılar ve hız sınırı paylaşılır)"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+    
+    def _acquire(self):
+        """Token bucket: kova boşsa bir token dolana kadar bekler"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate_per_second)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate_per_second
+            time.sleep(wait_seconds)
+    
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """retry-after başlığı varsa onu, yoksa üstel geri çekilme + rastgele sapma kullanır"""
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(self.backoff_max, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    retry_at = email.utils.parsedate_to_datetime(retry_after)
+                    return min(self.backoff_max, max(0.0, retry_at.timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+        return min(self.backoff_max, self.backoff_base * (2 ** attempt) + random.uniform(0, self.backoff_base))
+    
+    def post(self, url: str, headers: Dict, json: Dict, timeout: float = 10,
+             max_retries: Optional[int] = None, max_total: Optional[float] = None) -> requests.Response:
+        """POST; 429/5xx ve timeout/bağlantı hatalarında yeniden dener.
+        
+        Son denemenin yanıtı döner ya da son hatası fırlatılır. max_total verilirse
+        her deneme kalan süreyle sınırlanır ve bekleme bu süreyi aşacaksa yeniden denenmez.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        started = time.monotonic()
+        
+        for attempt in range(max_retries + 1):
+            self._acquire()
+            attempt_timeout = timeout
+            if max_total is not None:
+                attempt_timeout = max(0.1, min(timeout, max_total - (time.monotonic() - started)))
+            try:
+                response = self.session.post(url, headers=headers, json=json, timeout=attempt_timeout)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                if attempt == max_retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                if max_total is not None and time.monotonic() - started + delay >= max_total:
+                    raise
+            else:
+                if response.status_code not in self.RETRY_STATUSES or attempt == max_retries:
+                    return response
+                delay = self._retry_delay(attempt, response)
+                if max_total is not None and time.monotonic() - started + delay >= max_total:
+                    return response
+                print(f"Claude API status {response.status_code}, retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
 
-Verfügbare EKS-Felder:
+class ClaudeAPIHelper:
+    """Claude API entegrasyonu için yardımcı sınıf"""
+    
+    # Tüm istemlerde ortak EKS alan listesi
+    EKS_FIELDS_PROMPT = """Verfügbare EKS-Felder:
 A1: Betriebseinnahmen
 A5: Vereinnahmte Umsatzsteuer  
 A7: Vom Finanzamt erstattete Umsatzsteuer
@@ -184,61 +390,533 @@ B14e: Reinigung
 B14f: Repräsentationskosten
 B14h: Sonstige Betriebliche Ausgaben
 B17: Gezahlte Vorsteuer
-B18: An Finanzamt gezahlte Umsatzsteuer
-
-Antworte im JSON-Format:
-{{"suggestion": "EKS_FIELD", "confidence": 85, "reason": "Kurze Begründung"}}"""
-
-            headers = {
-                "Content-Type": "application/json",
-                "x-api-key": self.api_key,  # x-api-key kullan
-                "anthropic-version": "2023-06-01"
-            }
-            
-            data = {
-                "model": "claude-3-haiku-20240307",  # Daha ucuz model
-                "max_tokens": 200,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            }
-            
-            response = requests.post(self.base_url, headers=headers, json=data, timeout=10)
+B18: An Finanzamt gezahlte Umsatzsteuer"""
+    
+    # İstem metni değiştiğinde artırılır; eski önbellek kayıtları böylece kullanılmaz
+    PROMPT_VERSION = 1
+    # Modelin yanıt sınırı (claude-3-haiku: 4096 token); toplu istekte hesap başına ayrılan token
+    MAX_OUTPUT_TOKENS = 4096
+    BATCH_TOKENS_PER_ACCOUNT = 120
+    
+    def __init__(self, api_key: str = None, cache: Optional[AISuggestionCache] = None,
+                 http_client: Optional[ClaudeHTTPClient] = None, base_url: Optional[str] = None):
+        self.api_key = api_key
+        self.base_url = base_url or DEFAULT_CLAUDE_API_URL  # settings.json: claude_api_url (örn. yerel test sunucusu)
+        self.model = "claude-3-haiku-20240307"  # Daha ucuz model
+        self.cache = cache if cache is not None else AISuggestionCache()
+        self.http = http_client if http_client is not None else ClaudeHTTPClient.shared()
+        
+    def is_available(self) -> bool:
+        """API kullanılabilir mi kontrol eder"""
+        return bool(self.api_key and len(self.api_key) > 10)
+    
+    def _post_messages(self, prompt: str, max_tokens: int, timeout: float = 10,
+                       deadline: Optional[float] = None) -> Tuple[Optional[str], str]:
+        """Messages API'ye tek bir istem gönderir; (yanıt metni, hata nedeni) döndürür.
+        
+        Yeniden denemeler dahil toplam süre timeout'u, deadline (time.monotonic()) verilirse
+        kalan süreyi aşmaz.
+        """
+        max_total = timeout if deadline is None else min(timeout, deadline - time.monotonic())
+        if max_total <= 0:
+            return None, "Request timeout"
+        
+        headers = {
+            "Content-Type": "application/json",
+            "x-api-key": self.api_key,  # x-api-key kullan
+            "anthropic-version": "2023-06-01"
+        }
+        
+        data = {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        }
+        
+        try:
+            response = self.http.post(self.base_url, headers=headers, json=data, timeout=timeout,
+                                      max_total=max_total)
             
             if response.status_code == 200:
                 result = response.json()
-                content = result["content"][0]["text"]
-                
-                # JSON'u düzgün parse et
-                import re
-                json_match = re.search(r'\{[^}]+\}', content)
-                if json_match:
-                    try:
-                        suggestion = json.loads(json_match.group())
-                        return suggestion
-                    except json.JSONDecodeError:
-                        return {"suggestion": None, "confidence": 0, "reason": "Invalid JSON response"}
-                else:
-                    return {"suggestion": None, "confidence": 0, "reason": "No JSON found in response"}
-            else:
-                error_msg = response.json().get('error', {}).get('message', f'Status: {response.status_code}')
-                return {"suggestion": None, "confidence": 0, "reason": f"API Error: {error_msg}"}
-                
+                return result["content"][0]["text"], ""
+            error_msg = response.json().get('error', {}).get('message', f'Status: {response.status_code}')
+            return None, f"API Error: {error_msg}"
         except requests.exceptions.Timeout:
-            return {"suggestion": None, "confidence": 0, "reason": "Request timeout"}
+            return None, "Request timeout"
         except Exception as e:
-            return {"suggestion": None, "confidence": 0, "reason": f"Error: {str(e)}"}
+            return None, f"Error: {str(e)}"
+    
+    def _cache_key(self, account_code: str, description: str) -> str:
+        return AISuggestionCache.make_key(account_code, description, self.model, self.PROMPT_VERSION)
+    
+    def suggest_mapping(self, account_code: str, description: str, bwa_context: str = "",
+                        deadline: Optional[float] = None) -> Dict:
+        """Bilinmeyen hesap kodu için EKS eşleştirme önerisi (önbellekte varsa API'ye gidilmez)"""
+        if not self.is_available():
+            return {"suggestion": None, "confidence": 0, "reason": "API key not available"}
+        
+        cache_key = self._cache_key(account_code, description)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        prompt = f"""Du bist ein Experte für deutsche Buchführung und EKS-Formulare.
+
+BWA Hesap Kodu: {account_code}
+Beschreibung: {description}
+Kontext: {bwa_context}
+
+Welches EKS-Feld passt am besten zu diesem BWA-Konto? 
+
+{self.EKS_FIELDS_PROMPT}
+
+Antworte im JSON-Format:
+{{"suggestion": "EKS_FIELD", "confidence": 85, "reason": "Kurze Begründung"}}"""
+
+        content, error = self._post_messages(prompt, max_tokens=200, deadline=deadline)
+        if content is None:
+            return {"suggestion": None, "confidence": 0, "reason": error}
+        
+        # JSON'u düzgün parse et
+        json_match = re.search(r'\{[^}]+\}', content)
+        if json_match:
+            try:
+                suggestion = json.loads(json_match.group())
+                # Geçerli yanıtlar ("öneri yok" dahil) önbelleğe alınır, hatalar alınmaz
+                # Diske yazım çağıranın işidir (toplu işlem sonunda bir kez)
+                self.cache.put(cache_key, suggestion)
+                return suggestion
+            except json.JSONDecodeError:
+                return {"suggestion": None, "confidence": 0, "reason": "Invalid JSON response"}
+        else:
+            return {"suggestion": None, "confidence": 0, "reason": "No JSON found in response"}
+    
+    def suggest_mappings_batch(self, accounts: List[Dict], timeout: float = 20,
+                               deadline: Optional[float] = None) -> List[Optional[Dict]]:
+        """Tüm hesaplar için toplu istekle öneri alır (yanıt bir JSON dizisi).
+        
+        Sonuç listesi giriş sırasındadır; yanıtta bulunamayan veya parse edilemeyen
+        hesaplar için None döner (çağıran bunları tek tek sorabilir). Yanıt token sınırına
+        sığmayan listeler parçalara bölünür; parçalar sırayla aynı süre sınırını kullanır.
+        """
+        if not self.is_available():
+            return [{"suggestion": None, "confidence": 0, "reason": "API key not available"} for _ in accounts]
+        if not accounts:
+            return []
+        
+        # Önbellekte olanlar isteğe hiç girmez
+        cache_keys = [self._cache_key(account['account'], account['description']) for account in accounts]
+        results = [self.cache.get(key) for key in cache_keys]
+        pending = [i for i, result in enumerate(results) if result is None]
+        
+        chunk_size = max(1, (self.MAX_OUTPUT_TOKENS - 100) // self.BATCH_TOKENS_PER_ACCOUNT)
+        for start in range(0, len(pending), chunk_size):
+            self._request_batch(accounts, pending[start:start + chunk_size], cache_keys, results, timeout, deadline)
+        self.cache.save()
+        return results
+    
+    def _request_batch(self, accounts: List[Dict], pending: List[int], cache_keys: List[str],
+                       results: List[Optional[Dict]], timeout: float, deadline: Optional[float]):
+        """Tek bir toplu istek; 'pending' indeksli hesapların sonuçlarını 'results' içine yazar"""
+        account_lines = "\n".join(
+            f"- Konto: {accounts[i]['account']} | Beschreibung: {accounts[i]['description']} | Monatswerte: {accounts[i]['values'][:3]}"
+            for i in pending
+        )
+        prompt = f"""Du bist ein Experte für deutsche Buchführung und EKS-Formulare.
+
+Ordne jedes der folgenden BWA-Konten dem passendsten EKS-Feld zu:
+{account_lines}
+
+{self.EKS_FIELDS_PROMPT}
+
+Antworte ausschließlich mit einem JSON-Array, ein Objekt pro Konto in derselben Reihenfolge:
+[{{"account": "KONTO", "suggestion": "EKS_FIELD", "confidence": 85, "reason": "Kurze Begründung"}}]
+Wenn kein Feld passt, setze "suggestion" auf null."""
+
+        max_tokens = min(self.MAX_OUTPUT_TOKENS, 100 + self.BATCH_TOKENS_PER_ACCOUNT * len(pending))
+        content, error = self._post_messages(prompt, max_tokens=max_tokens, timeout=timeout, deadline=deadline)
+        if content is None:
+            # İstek başarısız: tek tek denemek aynı hatayı N kez tekrarlar
+            for i in pending:
+                results[i] = {"suggestion": None, "confidence": 0, "reason": error}
+            return
         
+        by_account = {}
+        for entry in self._parse_batch_response(content):
+            account = str(entry.get("account", "")).strip()
+            if account and "suggestion" in entry:
+                by_account.setdefault(account, entry)
+        for i in pending:
+            results[i] = by_account.get(str(accounts[i]['account']).strip())
+            if results[i] is not None:
+                self.cache.put(cache_keys[i], results[i])
+    
+    @staticmethod
+    def _parse_batch_response(content: str) -> List[Dict]:
+        """Yanıttaki JSON dizisini okur; dizi bozuksa tek tek geçerli nesneleri toplar"""
+        array_match = re.search(r'\[.*\]', content, re.DOTALL)
+        if array_match:
+            try:
+                entries = json.loads(array_match.group())
+                if isinstance(entries, list):
+                    return [entry for entry in entries if isinstance(entry, dict)]
+            except json.JSONDecodeError:
+                pass
+        
+        entries = []
+        for object_match in re.finditer(r'\{[^{}]*\}', content):
+            try:
+                entries.append(json.loads(object_match.group()))
+            except json.JSONDecodeError:
+                continue
+        return entries
+        
+# Kontenrahmen -> EKS alanı: (ilk hesap, son hesap, EKS alanı, güven). Dar aralıklar geniş olanlara göre önceliklidir.
+SKR_ACCOUNT_RANGES = {
+    "SKR04": [
+        (1400, 1439, "B17", 85),   # Abziehbare Vorsteuer
+        (3800, 3819, "A5", 80),    # Umsatzsteuer
+        (3820, 3839, "B18", 85),   # Umsatzsteuer-Vorauszahlungen
+        (4000, 4799, "A1", 80),    # Umsatzerlöse
+        (5000, 5999, "B1", 80),    # Material- und Wareneingang
+        (6030, 6039, "B2c", 85),   # Aushilfslöhne
+        (6300, 6399, "B14h", 55),  # Sonstige Raumkosten
+        (6305, 6329, "B3", 80),    # Miete, Heizung, Gas/Strom/Wasser
+        (6330, 6339, "B14e", 85),  # Reinigung
+        (6610, 6649, "B14f", 70),  # Geschenke, Repräsentation, Bewirtung
+        (6800, 6899, "B14h", 55),  # Sonstige betriebliche Aufwendungen
+        (6800, 6804, "B10", 80),   # Porto
+        (6805, 6814, "B11", 85),   # Telefon, Internet
+        (6815, 6819, "B10", 85),   # Bürobedarf
+        (6855, 6859, "B14c", 85),  # Nebenkosten des Geldverkehrs
+    ],
+    "SKR03": [
+        (1570, 1589, "B17", 85),   # Abziehbare Vorsteuer
+        (1770, 1779, "A5", 80),    # Umsatzsteuer
+        (1780, 1789, "B18", 85),   # Umsatzsteuer-Vorauszahlungen
+        (3000, 3999, "B1", 80),    # Wareneingang
+        (4190, 4199, "B2c", 85),   # Aushilfslöhne
+        (4200, 4299, "B14h", 55),  # Sonstige Raumkosten
+        (4210, 4249, "B3", 80),    # Miete, Heizung, Gas/Strom/Wasser
+        (4250, 4259, "B14e", 85),  # Reinigung
+        (4630, 4654, "B14f", 70),  # Geschenke, Repräsentation, Bewirtung
+        (4900, 4999, "B14h", 55),  # Sonstige betriebliche Aufwendungen
+        (4910, 4919, "B10", 80),   # Porto
+        (4920, 4929, "B11", 85),   # Telefon, Internet
+        (4930, 4939, "B10", 85),   # Bürobedarf
+        (4970, 4979, "B14c", 85),  # Nebenkosten des Geldverkehrs
+        (8000, 8799, "A1", 80),    # Umsatzerlöse
+    ],
+}
+
+
+class LocalSuggester:
+    """İnternetsiz eşleştirme önerileri: kontenrahmen aralıkları, daha önce kabul edilen
+    eşleştirmeler ve açıklamaların bulanık kelime karşılaştırması"""
+    
+    STOPWORDS = {"und", "plus", "des", "der", "die", "das", "den", "für", "fuer", "mit", "von", "zum", "zur", "alt", "neu"}
+    MIN_TEXT_SCORE = 0.5  # Bunun altındaki açıklama benzerlikleri öneri sayılmaz
+    
+    def __init__(self, chart: str = "SKR04", accepted_path: str = os.path.join("data", "accepted_mappings.json")):
+        self.chart = chart
+        self.accepted_path = accepted_path
+        self._accepted = None  # "kontenrahmen|hesap kodu" -> {'field', 'description'}; ilk kullanımda yüklenir
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _tokens(text: str) -> List[str]:
+        """Küçük harf, umlaut açılımı, anlamlı kelimeler"""
+        text = str(text or "").casefold()
+        for source, target in (("ä", "ae"), ("ö", "oe"), ("ü", "ue"), ("ß", "ss")):
+            text = text.replace(source, target)
+        return [t for t in re.findall(r'[a-z]+', text) if len(t) >= 3 and t not in LocalSuggester.STOPWORDS]
+    
+    @staticmethod
+    def _token_similarity(a: str, b: str) -> float:
+        if a == b:
+            return 1.0
+        if min(len(a), len(b)) >= 4 and (a.startswith(b) or b.startswith(a)):
+            return 0.9
+        ratio = difflib.SequenceMatcher(None, a, b).ratio()
+        if ratio >= 0.8:
+            return ratio
+        # Ortak kelime kökü ("Bürobedarf" / "Büromaterial")
+        return 0.6 if len(os.path.commonprefix([a, b])) >= 5 else 0.0
+    
+    @classmethod
+    def _text_similarity(cls, a: List[str], b: List[str]) -> float:
+        """Dice benzeri skor: her kelimenin karşı taraftaki en iyi eşi"""
+        if not a or not b:
+            return 0.0
+        matched = sum(max(cls._token_similarity(x, y) for y in b) for x in a)
+        matched += sum(max(cls._token_similarity(y, x) for x in a) for y in b)
+        return matched / (len(a) + len(b))
+    
+    def _load_accepted(self) -> Dict:
+        if self._accepted is None:
+            try:
+                with open(self.accepted_path, 'r', encoding='utf-8') as f:
+                    self._accepted = json.load(f)
+            except FileNotFoundError:
+                self._accepted = {}
+            except Exception as e:
+                print(f"Accepted mappings unreadable: {e}")
+                self._accepted = {}
+        return self._accepted
+    
+    def _accepted_key(self, account_code: str) -> str:
+        # Aynı hesap numarası farklı kontenrahmende başka anlama gelir (SKR03 4930 ≠ SKR04 4930)
+        return f"{self.chart}|{str(account_code).strip()}"
+    
+    def remember(self, account_code: str, description: str, eks_field: str):
+        """Kabul edilen bir eşleştirmeyi sonraki müşteriler için (kontenrahmen bazında) saklar"""
+        with self._lock:
+            accepted = self._load_accepted()
+            accepted[self._accepted_key(account_code)] = {'field': eks_field, 'description': description}
+            try:
+                os.makedirs(os.path.dirname(self.accepted_path) or ".", exist_ok=True)
+                tmp_path = self.accepted_path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(accepted, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.accepted_path)
+            except Exception as e:
+                print(f"Accepted mappings write error: {e}")
+    
+    def _chart_match(self, account_code: str) -> Optional[Tuple[int, int, str, int]]:
+        """Hesabı kapsayan en dar kontenrahmen aralığı"""
+        if not str(account_code).isdigit():
+            return None
+        number = int(account_code)
+        matches = [r for r in SKR_ACCOUNT_RANGES.get(self.chart, []) if r[0] <= number <= r[1]]
+        return min(matches, key=lambda r: r[1] - r[0]) if matches else None
+    
+    def suggest(self, account_code: str, description: str, rules: List[MappingRule]) -> Dict:
+        """AI ile aynı biçimde öneri: {'suggestion', 'confidence', 'reason'}"""
+        account_code = str(account_code).strip()
+        with self._lock:
+            accepted = dict(self._load_accepted())
+        
+        # Kontenrahmen bilgisi olmayan eski kayıtlar doğrudan eşleşmez, sadece açıklama benzerliğinde kullanılır
+        accepted_entry = accepted.get(self._accepted_key(account_code))
+        if accepted_entry is not None:
+            return {"suggestion": accepted_entry['field'], "confidence": 95,
+                    "reason": "Früher akzeptierte Zuordnung"}
+        
+        candidates = []
+        chart_range = self._chart_match(account_code)
+        if chart_range:
+            low, high, field_name, confidence = chart_range
+            candidates.append((confidence, field_name, f"{self.chart} Kontenbereich {low}-{high}"))
+        
+        # Açıklama benzerliği: kural açıklamaları ve kabul edilen eşleştirmeler
+        tokens = self._tokens(description)
+        references = [(rule.eks_field, rule.description_de) for rule in rules]
+        references += [(entry['field'], entry['description']) for entry in accepted.values()]
+        for field_name, reference in references:
+            score = self._text_similarity(tokens, self._tokens(reference))
+            if score >= self.MIN_TEXT_SCORE:
+                candidates.append((int(round(score * 85)), field_name, f"Ähnliche Bezeichnung: {reference}"))
+        
+        if not candidates:
+            return {"suggestion": None, "confidence": 0, "reason": "Keine lokale Zuordnung"}
+        confidence, field_name, reason = max(candidates, key=lambda c: c[0])
+        return {"suggestion": field_name, "confidence": confidence, "reason": reason}
+
+
+class BWAParseCache:
+    """BWA parse sonuçlarını dosya içeriğinin hash'ine göre diskte saklar (LRU, boyut sınırlı).
+    
+    Kayıt: 4 bayt uzunluk + JSON meta veri (aylar, müşteri bilgisi) + BWASnapshotCodec verisi.
+    Çalıştırılabilir içerik (pickle) yok; klasör ilk yazmada oluşturulur.
+    """
+    
+    EXTENSION = ".bwacache"
+    
+    def __init__(self, cache_dir: str = os.path.join("data", "cache", "bwa"), max_bytes: int = 200 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def file_digest(file_path: str) -> str:
+        """Dosya içeriğinin SHA-256 hash'i"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def _entry_path(self, content_hash: str, parser_version: int) -> str:
+        return os.path.join(self.cache_dir, f"{content_hash}-v{parser_version}{self.EXTENSION}")
+    
+    def get(self, content_hash: str, parser_version: int) -> Optional[Dict]:
+        path = self._entry_path(content_hash, parser_version)
+        with self._lock:
+            try:
+                with open(path, 'rb') as f:
+                    raw = f.read()
+                meta_length = int.from_bytes(raw[:4], 'little')
+                payload = json.loads(raw[4:4 + meta_length].decode('utf-8'))
+                payload['bwa_data'] = BWASnapshotCodec.decode(raw[4 + meta_length:])
+                # LRU için son kullanım zamanını güncelle
+                os.utime(path)
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            except Exception as e:
+                print(f"Parse cache entry unreadable, removing: {e}")
+                self._remove(path)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return payload
+    
+    def put(self, content_hash: str, parser_version: int, payload: Dict):
+        path = self._entry_path(content_hash, parser_version)
+        with self._lock:
+            try:
+                meta = json.dumps({key: value for key, value in payload.items() if key != 'bwa_data'},
+                                  ensure_ascii=False).encode('utf-8')
+                _, frame = BWASnapshotCodec.encode(payload['bwa_data'])
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(len(meta).to_bytes(4, 'little') + meta + frame)
+                os.replace(tmp_path, path)
+                self._evict()
+            except Exception as e:
+                print(f"Parse cache write error: {e}")
+    
+    def _evict(self):
+        """Toplam boyut sınırı aşılırsa en uzun süredir kullanılmayan kayıtları siler"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                # Eski pickle kayıtları artık okunmuyor
+                self._remove(entry.path)
+            elif entry.name.endswith(self.EXTENSION):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+    
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def stats(self) -> Dict:
+        """Önbellek isabet/ıska sayıları"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0
+            }
+
+class RuleMatcher:
+    """Tüm kural terimlerini BWA metin sütununda tek geçişte arayan derlenmiş eşleştirici.
+    
+    Her terim için, terimi (büyük/küçük harf duyarsız) içeren ilk satır döner.
+    """
+    
+    def __init__(self, terms: List[str]):
+        self.terms = sorted({term for term in terms if term and term.strip()})
+        self._terms_for = {}
+        for term in self.terms:
+            self._terms_for.setdefault(term.upper(), []).append(term)
+        
+        # Alternatifler uzundan kısaya: her konumda en uzun eşleşen terim yakalanır,
+        # onun önekleri olan kısa terimler de aynı konumda eşleşmiş sayılır
+        needles = sorted(self._terms_for, key=len, reverse=True)
+        self._covered = {needle: [other for other in needles if needle.startswith(other)] for needle in needles}
+        alternation = '|'.join(re.escape(needle) for needle in needles)
+        self._pattern = re.compile(f'(?=({alternation}))') if needles else None
+    
+    def first_rows(self, texts: List[str]) -> Dict[str, Optional[int]]:
+        result = {term: None for term in self.terms}
+        if self._pattern is None or not texts:
+            return result
+        
+        upper_texts = [text.upper() for text in texts]
+        joined = '\x00'.join(upper_texts)
+        row_starts = list(itertools.accumulate((len(text) + 1 for text in upper_texts[:-1]), initial=0))
+        
+        remaining = set(self._terms_for)
+        for match in self._pattern.finditer(joined):
+            for needle in self._covered[match.group(1)]:
+                if needle in remaining:
+                    remaining.discard(needle)
+                    row_idx = bisect.bisect_right(row_starts, match.start()) - 1
+                    for term in self._terms_for[needle]:
+                        result[term] = row_idx
+            if not remaining:
+                break
+        return result
+
 class BWAParser:
-    def __init__(self):
+    # Parse sonucunu etkileyen her değişiklikte artırılmalı (parse önbelleği anahtarının parçası)
+    PARSER_VERSION = 3
+    
+    def __init__(self, parse_cache: Optional[BWAParseCache] = None):
         self.mapping_rules = self._init_mapping_rules()
         self.bwa_data = None
+        self.bwa_hash = None  # Yüklü BWA içeriğinin hash'i
         self.customer_info = None
         self.available_months = []
+        # Ay değerleri: satır x ay float64 matrisi ve dolu hücre maskesi (yüklemede bir kez oluşturulur)
+        self.month_matrix = np.empty((0, 0))
+        self.month_mask = np.empty((0, 0), dtype=bool)
+        self.month_positions = {}
+        # Aralık/önek kuralları için sıralı hesap kodu indeksi (ikili arama)
+        self._code_numbers = np.empty(0, dtype=np.int64)
+        self._code_number_rows = np.empty(0, dtype=np.intp)
+        self._code_strings = np.empty(0, dtype=str)
+        self._code_string_rows = np.empty(0, dtype=np.intp)
+        self._row_texts = []
+        # Kural seti sürümü: kurallar her değiştiğinde artar (derlenmiş eşleştirici önbelleği için)
+        self.rules_version = 0
+        # Kontenbereich-Regel penceresinde kaydedilen kurallar (alan -> kural) bu dosyada saklanır;
+        # kabul edilen öneriler sadece oturumdaki kurala eklenir, dosyaya yazılmaz
+        self.rules_path = os.path.join("data", "mapping_rules.json")
+        self.custom_rules = {}
+        self._matcher = None
+        self._matcher_version = -1
+        self._rule_rows = None
+        self._selection = None
+        # Dönem sonuçları için LRU önbellek: (bwa_hash, rules_version, başlangıç, bitiş, alanlar) -> sonuç
+        self._period_cache = OrderedDict()
+        self.period_cache_size = 32
+        # Alan x ay tablosu ve önek toplamları (her dönem penceresi O(1) okunur)
+        self._period_table = None
+        # AI'ya gönderilecek eşleştirilmemiş hesap sayısı (tutara göre en büyük k)
+        self.unmapped_top_k = 5
+        # AI önerileri: aynı anda en fazla kaç istek, tüm istekler için toplam süre sınırı (saniye)
+        self.ai_max_in_flight = 4
+        self.ai_deadline = 20.0
+        # Önce yerel öneriler; güveni bu eşiğin altındaki hesaplar AI'ya sorulur
+        self.local_suggester = LocalSuggester()
+        self.local_confidence_threshold = 70
         self.claude_api = None  # Claude API helper
+        self.parse_cache = parse_cache if parse_cache is not None else BWAParseCache()
+        # Parse önbelleği isabet/ıska sayıları (her load_bwa_file sonrası güncellenir)
+        self.cache_stats = self.parse_cache.stats()
         
     def _init_mapping_rules(self) -> Dict[str, MappingRule]:
         return {
@@ -263,191 +941,192 @@ class BWAParser:
             "B18": MappingRule("B18", "3820", "direct", ["3820"], "an Finanzamt gezahlte USt")
         }
     
-    def set_claude_api(self, api_key: str):
+    def add_mapping_rule(self, rule: MappingRule) -> List[str]:
+        """Kural ekler/değiştirir ve etkilenen alanları döndürür.
+        
+        Yüklü bir BWA varsa sadece bu kuralın terimleri çözülür ve seçim matrisi
+        yerinde güncellenir; diğer alanlar yeniden hesaplanmaz.
+        """
+        previous_version = self.rules_version
+        self.mapping_rules[rule.eks_field] = rule
+        self.rules_version += 1
+        self._period_cache.clear()
+        
+        if self._rule_rows is not None and self._rule_rows[0] == previous_version:
+            term_rows = dict(self._rule_rows[1])
+            new_terms = [term for term in self._rule_terms(rule) if term not in term_rows]
+            if new_terms:
+                term_rows.update(RuleMatcher(new_terms).first_rows(self._row_texts))
+            self._rule_rows = (self.rules_version, term_rows)
+            
+            if self._selection is not None and self._selection['version'] == previous_version:
+                self._selection = self._patch_selection(self._selection, rule, term_rows)
+        
+        return [rule.eks_field]
+    
+    def add_account_to_rule(self, eks_field: str, account: str, description: str = "") -> List[str]:
+        """Kabul edilen bir hesabı alanın mevcut kuralına ekler; kaynaklar, aralıklar ve önekler korunur"""
+        account = str(account).strip()
+        rule = self.mapping_rules.get(eks_field)
+        if rule is None:
+            rule = MappingRule(eks_field, account, "direct", [account], description)
+        elif rule.calculation_type == "sum":
+            if account in (rule.source_accounts or []):
+                return []
+            rule = replace(rule, source_accounts=list(rule.source_accounts or []) + [account])
+        elif account == rule.bwa_source:
+            return []
+        else:
+            # 'direct' kural iki kaynaklı toplam kuralına dönüşür; mevcut kaynak satırı aynen kalır
+            rule = replace(rule, calculation_type="sum", source_accounts=[rule.bwa_source, account])
+        return self.add_mapping_rule(rule)
+    
+    def set_account_ranges(self, eks_field: str, account_ranges: List[Tuple[str, str]],
+                           account_prefixes: List[str]) -> List[str]:
+        """Alanın aralık/önek kuralını değiştirir ve kalıcı kurallara alır.
+        
+        Kalıcı kural varsayılan (veya daha önce kaydedilmiş) kuraldan türetilir; oturumda
+        kabul edilmiş hesaplar sadece çalışan kuralda kalır.
+        """
+        base = self.custom_rules.get(eks_field) or self._init_mapping_rules().get(eks_field)
+        if base is None:
+            base = MappingRule(eks_field, "Kontenbereich", "sum", [], eks_field)
+        self.custom_rules[eks_field] = replace(base, account_ranges=account_ranges, account_prefixes=account_prefixes)
+        live = self.mapping_rules.get(eks_field, self.custom_rules[eks_field])
+        return self.add_mapping_rule(replace(live, account_ranges=account_ranges, account_prefixes=account_prefixes))
+    
+    def reset_mapping_rules(self, fields: Optional[List[str]] = None) -> List[str]:
+        """Alanların (verilmezse varsayılandan farklı tüm alanların) kuralını varsayılana döndürür.
+        
+        Kaydedilmiş kurallardan da çıkarılır; varsayılanı olmayan alanlar silinir. Değişen alanları döndürür.
+        """
+        defaults = self._init_mapping_rules()
+        if fields is None:
+            fields = [field for field, rule in self.mapping_rules.items() if rule != defaults.get(field)]
+            fields += [field for field in self.custom_rules if field not in fields]
+        
+        changed = []
+        for eks_field in fields:
+            self.custom_rules.pop(eks_field, None)
+            if eks_field in defaults:
+                if self.mapping_rules.get(eks_field) != defaults[eks_field]:
+                    changed += self.add_mapping_rule(defaults[eks_field])
+            elif eks_field in self.mapping_rules:
+                del self.mapping_rules[eks_field]
+                self.rules_version += 1
+                self._period_cache.clear()
+                changed.append(eks_field)
+        return changed
+    
+    def save_mapping_rules(self) -> bool:
+        """Kontenbereich-Regel penceresinde kaydedilen kuralları JSON dosyasına yazar"""
+        rules = [asdict(self.custom_rules[eks_field]) for eks_field in sorted(self.custom_rules)]
+        try:
+            os.makedirs(os.path.dirname(self.rules_path) or ".", exist_ok=True)
+            tmp_path = self.rules_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(rules, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.rules_path)
+            return True
+        except Exception as e:
+            print(f"Mapping rules write error: {e}")
+            return False
+    
+    def load_mapping_rules(self) -> int:
+        """Kaydedilmiş kullanıcı kurallarını yükler; geçersiz kurallar atlanır"""
+        try:
+            with open(self.rules_path, 'r', encoding='utf-8') as f:
+                rules = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            print(f"Mapping rules unreadable: {e}")
+            return 0
+        
+        loaded = 0
+        for data in rules:
+            try:
+                rule = MappingRule(**data)
+            except (TypeError, ValueError) as e:
+                print(f"Mapping rule skipped: {e}")
+                continue
+            self.custom_rules[rule.eks_field] = rule
+            self.add_mapping_rule(rule)
+            loaded += 1
+        return loaded
+    
+    @staticmethod
+    def _rule_terms(rule: MappingRule) -> List[str]:
+        """Bir kuralın BWA'da aranan terimleri"""
+        if rule.calculation_type == "direct":
+            return [rule.bwa_source]
+        if rule.calculation_type == "sum":
+            return list(rule.source_accounts or [])
+        return []
+    
+    def _get_rule_matcher(self) -> RuleMatcher:
+        """Kural setinin derlenmiş eşleştiricisi; sadece kurallar değiştiğinde yeniden derlenir"""
+        if self._matcher is None or self._matcher_version != self.rules_version:
+            terms = []
+            for rule in self.mapping_rules.values():
+                terms.extend(self._rule_terms(rule))
+            self._matcher = RuleMatcher(terms)
+            self._matcher_version = self.rules_version
+        return self._matcher
+    
+    def _resolve_rule_terms(self) -> Dict[str, Optional[int]]:
+        """Tüm kural terimlerinin ilk eşleşen satırları (BWA ve kural seti başına bir kez hesaplanır)"""
+        if self._rule_rows is None or self._rule_rows[0] != self.rules_version:
+            self._rule_rows = (self.rules_version, self._get_rule_matcher().first_rows(self._row_texts))
+        return self._rule_rows[1]
+    
+    def set_claude_api(self, api_key: str, base_url: Optional[str] = None):
         """Claude API helper'ı ayarla"""
-        self.claude_api = ClaudeAPIHelper(api_key)
+        self.claude_api = ClaudeAPIHelper(api_key, base_url=base_url)
         print(f"Claude API configured with key: {api_key[:20]}..." if len(api_key) > 20 else f"Claude API configured")
     
-    def load_bwa_file(self, file_path: str) -> Tuple[bool, str]:
+    def load_bwa_file(self, file_path: str, streaming: bool = True) -> Tuple[bool, str]:
         try:
+            # Aynı içerik daha önce parse edildiyse önbellekten yükle
+            content_hash = BWAParseCache.file_digest(file_path)
+            cached = self.parse_cache.get(content_hash, self.PARSER_VERSION)
+            self.cache_stats = self.parse_cache.stats()
+            if cached is not None:
+                self.bwa_data = cached['bwa_data']
+                self.available_months = cached['available_months']
+                if cached['customer_info']:
+                    self.customer_info = cached['customer_info']
+                self.bwa_hash = content_hash
+                self._prepare_data()
+                print(f"BWA loaded from parse cache: {os.path.basename(file_path)} ({self.cache_stats})")
+                return True, f"BWA geladen: {len(self.available_months)} Monate verfügbar"
+            
             # .xls ve .xlsx formatlarını destekle
             file_ext = os.path.splitext(file_path)[1].lower()
             
             if file_ext == '.xls':
-                # Eski Excel formatı için xlrd kullan
-                import xlrd
-                workbook = xlrd.open_workbook(file_path)
-                sheet = workbook.sheet_by_index(0)
-                
-                # xlrd verisini pandas DataFrame'e dönüştür
-                data = []
-                for row_idx in range(sheet.nrows):
-                    data.append([sheet.cell_value(row_idx, col_idx) for col_idx in range(sheet.ncols)])
-                df = pd.DataFrame(data)
+                # Eski Excel formatı için xlrd kullan - satır/sütun blokları halinde
+                layout, columns = self._read_xls_columns(file_path)
+            elif streaming:
+                # Modern Excel formatı (.xlsx) - read-only modda satır satır oku
+                layout, columns = self._read_xlsx_streaming(file_path)
             else:
                 # Modern Excel formatı (.xlsx) - pandas ile direkt oku
                 df = pd.read_excel(file_path, header=None, engine='openpyxl')
+                layout, columns = self._extract_frame_columns(df, file_path)
             
-            print(f"\n{'='*60}")
-            print(f"Excel loaded: {os.path.basename(file_path)}")
-            print(f"Shape: {df.shape}")
-            print(f"First 5 rows:")
-            for i in range(min(5, len(df))):
-                print(f"Row {i}: {df.iloc[i, 0]} | {df.iloc[i, 1] if df.shape[1] > 1 else ''}")
-            print(f"{'='*60}\n")
-            
-            # Müşteri bilgisini bul - GELİŞTİRİLMİŞ
-            customer_found = False
-            for row_idx in range(min(10, len(df))):
-                # Tüm sütunları kontrol et
-                for col_idx in range(min(5, df.shape[1])):
-                    try:
-                        cell_value = df.iloc[row_idx, col_idx]
-                        if pd.isna(cell_value):
-                            continue
-                        
-                        cell_str = str(cell_value).strip()
-                        
-                        if len(cell_str) > 6:
-                            # Boşlukla ayrılmış format: "111051 Sherzad Farman Jindi"
-                            parts = cell_str.split(None, 1)
-                            if len(parts) >= 2 and parts[0].isdigit() and len(parts[0]) >= 4:
-                                self.customer_info = {
-                                    "code": parts[0],
-                                    "name": parts[1]
-                                }
-                                customer_found = True
-                                print(f"Customer found at row {row_idx}, col {col_idx}: {self.customer_info}")
-                                break
-                            
-                            # Köşeli parantez format: "[1105] Sherzad Farman Jindi"
-                            if cell_str.startswith('[') and ']' in cell_str:
-                                bracket_end = cell_str.index(']')
-                                code_part = cell_str[1:bracket_end]
-                                name_part = cell_str[bracket_end+1:].strip()
-                                if code_part.isdigit() and name_part:
-                                    self.customer_info = {
-                                        "code": code_part,
-                                        "name": name_part
-                                    }
-                                    customer_found = True
-                                    print(f"Customer found (bracket) at row {row_idx}, col {col_idx}: {self.customer_info}")
-                                    break
-                    except Exception as e:
-                        print(f"Error checking cell [{row_idx}, {col_idx}]: {e}")
-                        continue
-                
-                if customer_found:
-                    break
-            
-            if not customer_found:
+            if layout['customer_info']:
+                self.customer_info = layout['customer_info']
+            else:
                 print("Warning: Customer info not detected")
             
-            # Header satırını bul
-            header_row = -1
-            konto_col = -1
-            bezeichnung_col = -1
-            
-            for row_idx in range(min(15, len(df))):
-                row = df.iloc[row_idx]
-                
-                has_konto = False
-                has_months = False
-                
-                for col_idx in range(len(row)):
-                    try:
-                        cell = row.iloc[col_idx]
-                        if pd.isna(cell):
-                            continue
-                        
-                        cell_str = str(cell).upper().strip()
-                        
-                        # "Konto" sütununu bul
-                        if 'KONTO' in cell_str and konto_col == -1:
-                            konto_col = col_idx
-                            has_konto = True
-                        
-                        # "Bezeichnung" sütununu bul
-                        if ('BEZEICHNUNG' in cell_str or 'DESCRIPTION' in cell_str) and bezeichnung_col == -1:
-                            bezeichnung_col = col_idx
-                        
-                        # Ay kontrolü
-                        if cell_str in ['JAN', 'FEB', 'MRZ', 'APR', 'MAI', 'JUN', 'JUL', 'AUG', 'SEP', 'OKT', 'NOV', 'DEZ']:
-                            has_months = True
-                    
-                    except Exception as e:
-                        continue
-                
-                if has_konto and has_months:
-                    header_row = row_idx
-                    print(f"Header found at row {header_row}")
-                    print(f"  Konto col: {konto_col}, Bezeichnung col: {bezeichnung_col}")
-                    break
-            
-            if header_row == -1:
+            if layout['header_row'] == -1:
                 return False, "BWA Header nicht gefunden"
             
-            # Veri satırlarını al
-            data_start_row = header_row + 1
-            self.bwa_data = df.iloc[data_start_row:].reset_index(drop=True)
-            
-            # Yeni DataFrame oluştur
-            new_df = pd.DataFrame()
-            
-            # Konto ve Bezeichnung'u birleştir
-            combined = []
-            for idx in range(len(self.bwa_data)):
-                try:
-                    if konto_col >= 0 and bezeichnung_col >= 0 and konto_col != bezeichnung_col:
-                        # FORMAT 2: Ayrı sütunlar
-                        konto_val = self.bwa_data.iloc[idx, konto_col]
-                        bez_val = self.bwa_data.iloc[idx, bezeichnung_col]
-                        
-                        konto_str = str(konto_val).strip() if pd.notna(konto_val) else ""
-                        bez_str = str(bez_val).strip() if pd.notna(bez_val) else ""
-                        
-                        if konto_str == 'nan':
-                            konto_str = ""
-                        if bez_str == 'nan':
-                            bez_str = ""
-                        
-                        combined_text = f"{konto_str} {bez_str}".strip()
-                        combined.append(combined_text)
-                    
-                    elif konto_col >= 0:
-                        # FORMAT 1: Tek sütun
-                        val = self.bwa_data.iloc[idx, konto_col]
-                        val_str = str(val).strip() if pd.notna(val) else ""
-                        if val_str == 'nan':
-                            val_str = ""
-                        combined.append(val_str)
-                    else:
-                        combined.append("")
-                
-                except Exception as e:
-                    print(f"Error at row {idx}: {e}")
-                    combined.append("")
-            
-            new_df['Konto_Bezeichnung'] = combined
-            
-            # Ay sütunlarını ekle
-            month_cols = ['JAN', 'FEB', 'MRZ', 'APR', 'MAI', 'JUN', 'JUL', 'AUG', 'SEP', 'OKT', 'NOV', 'DEZ']
-            header_row_data = df.iloc[header_row]
-            
-            months_found = []
-            for month in month_cols:
-                for col_idx in range(len(header_row_data)):
-                    try:
-                        cell = header_row_data.iloc[col_idx]
-                        if pd.notna(cell) and str(cell).upper().strip() == month:
-                            new_df[month] = self.bwa_data.iloc[:, col_idx].values
-                            months_found.append(month)
-                            break
-                    except Exception as e:
-                        continue
-            
-            self.bwa_data = new_df
-            self.available_months = months_found
+            self.bwa_data = self._build_bwa_data(columns)
+            self.bwa_hash = content_hash
+            self.available_months = list(layout['month_positions'])
+            self._prepare_data()
             
             print(f"Available months: {self.available_months}")
             print(f"Final shape: {self.bwa_data.shape}")
@@ -456,6 +1135,12 @@ class BWAParser:
             if not self.available_months:
                 return False, "Keine Monatsspalten gefunden"
             
+            self.parse_cache.put(content_hash, self.PARSER_VERSION, {
+                'bwa_data': self.bwa_data,
+                'available_months': self.available_months,
+                'customer_info': layout['customer_info']
+            })
+            
             return True, f"BWA geladen: {len(self.available_months)} Monate verfügbar"
             
         except Exception as e:
@@ -464,10 +1149,359 @@ class BWAParser:
             traceback.print_exc()
             return False, f"Fehler beim Laden: {str(e)}"
     
-    def extract_values_for_period(self, start_month: str, end_month: str) -> Dict:
+    def _extract_frame_columns(self, df: pd.DataFrame, file_path: str) -> Tuple[Dict, Optional[Dict]]:
+        """Tamamen okunmuş bir DataFrame'den layout'u ve gerekli sütunları çıkarır"""
+        print(f"\n{'='*60}")
+        print(f"Excel loaded: {os.path.basename(file_path)}")
+        print(f"Shape: {df.shape}")
+        print(f"First 5 rows:")
+        for i in range(min(5, len(df))):
+            print(f"Row {i}: {df.iloc[i, 0]} | {df.iloc[i, 1] if df.shape[1] > 1 else ''}")
+        print(f"{'='*60}\n")
+        
+        layout = self._detect_layout(df.iloc[:15].to_numpy(dtype=object))
+        if layout['header_row'] == -1:
+            return layout, None
+        
+        # Veri satırları: header'ın altındaki her şey
+        body = df.iloc[layout['header_row'] + 1:]
+        columns = {
+            'konto': body.iloc[:, layout['konto_col']].to_numpy(dtype=object),
+            'bezeichnung': None,
+            'months': {month: body.iloc[:, col_idx].to_numpy()
+                       for month, col_idx in layout['month_positions'].items()}
+        }
+        if layout['bezeichnung_col'] >= 0 and layout['bezeichnung_col'] != layout['konto_col']:
+            columns['bezeichnung'] = body.iloc[:, layout['bezeichnung_col']].to_numpy(dtype=object)
+        return layout, columns
+    
+    def _read_xlsx_streaming(self, file_path: str) -> Tuple[Dict, Optional[Dict]]:
+        """.xlsx dosyasını read-only modda okur ve sadece gerekli sütunları kopyalar"""
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            
+            # Header araması sadece üst blokta yapılır
+            top_rows = []
+            for row in rows:
+                top_rows.append(row)
+                if len(top_rows) == 15:
+                    break
+            
+            width = max((len(row) for row in top_rows), default=0)
+            top_block = np.full((len(top_rows), width), None, dtype=object)
+            for i, row in enumerate(top_rows):
+                top_block[i, :len(row)] = row
+            
+            print(f"\n{'='*60}")
+            print(f"Excel loaded (streaming): {os.path.basename(file_path)}")
+            print(f"First 5 rows:")
+            for i in range(min(5, len(top_rows))):
+                print(f"Row {i}: {top_block[i, 0] if width else ''} | {top_block[i, 1] if width > 1 else ''}")
+            print(f"{'='*60}\n")
+            
+            layout = self._detect_layout(top_block)
+            if layout['header_row'] == -1:
+                return layout, None
+            
+            # Sadece Konto, Bezeichnung ve ay sütunlarını kopyala
+            wanted = [layout['konto_col']]
+            has_bez = layout['bezeichnung_col'] >= 0 and layout['bezeichnung_col'] != layout['konto_col']
+            if has_bez:
+                wanted.append(layout['bezeichnung_col'])
+            wanted.extend(layout['month_positions'].values())
+            
+            last_col = max(wanted)
+            selected = []
+            last_filled = -1
+            for row in itertools.chain(top_rows[layout['header_row'] + 1:], rows):
+                if len(row) <= last_col:
+                    row = tuple(row) + (None,) * (last_col + 1 - len(row))
+                values = tuple(row[col_idx] for col_idx in wanted)
+                selected.append(values)
+                if any(v is not None for v in values):
+                    last_filled = len(selected) - 1
+            # pandas gibi sondaki boş satırları at
+            del selected[last_filled + 1:]
+        finally:
+            workbook.close()
+        
+        if selected:
+            arrays = [np.array(col, dtype=object) for col in zip(*selected)]
+        else:
+            arrays = [np.empty(0, dtype=object) for _ in wanted]
+        
+        offset = 2 if has_bez else 1
+        columns = {
+            'konto': arrays[0],
+            'bezeichnung': arrays[1] if has_bez else None,
+            'months': {month: arrays[offset + i] for i, month in enumerate(layout['month_positions'])}
+        }
+        return layout, columns
+    
+    def _read_xls_columns(self, file_path: str) -> Tuple[Dict, Optional[Dict]]:
+        """.xls dosyasını xlrd ile okur; hücre hücre değil, tüm satır/sütunları toplu çeker"""
+        import xlrd
+        workbook = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            sheet = workbook.sheet_by_index(0)
+            
+            # Header araması için sadece üst blok
+            top_count = min(15, sheet.nrows)
+            top_block = np.full((top_count, sheet.ncols), None, dtype=object)
+            for row_idx in range(top_count):
+                top_block[row_idx] = self._normalize_xls_values(sheet.row_values(row_idx), sheet.row_types(row_idx))
+            
+            print(f"\n{'='*60}")
+            print(f"Excel loaded (xls): {os.path.basename(file_path)}")
+            print(f"Shape: {(sheet.nrows, sheet.ncols)}")
+            print(f"First 5 rows:")
+            for i in range(min(5, top_count)):
+                print(f"Row {i}: {top_block[i, 0] if sheet.ncols else ''} | {top_block[i, 1] if sheet.ncols > 1 else ''}")
+            print(f"{'='*60}\n")
+            
+            layout = self._detect_layout(top_block)
+            if layout['header_row'] == -1:
+                return layout, None
+            
+            # Sadece Konto, Bezeichnung ve ay sütunlarını oku
+            start_row = layout['header_row'] + 1
+            
+            def read_column(col_idx: int) -> np.ndarray:
+                return self._normalize_xls_values(sheet.col_values(col_idx, start_rowx=start_row),
+                                                  sheet.col_types(col_idx, start_rowx=start_row))
+            
+            columns = {
+                'konto': read_column(layout['konto_col']),
+                'bezeichnung': None,
+                'months': {month: read_column(col_idx) for month, col_idx in layout['month_positions'].items()}
+            }
+            if layout['bezeichnung_col'] >= 0 and layout['bezeichnung_col'] != layout['konto_col']:
+                columns['bezeichnung'] = read_column(layout['bezeichnung_col'])
+        finally:
+            workbook.release_resources()
+        
+        # xlsx yolu gibi sondaki boş satırları at
+        selected = [columns['konto'], columns['bezeichnung'], *columns['months'].values()]
+        filled = np.zeros(len(columns['konto']), dtype=bool)
+        for values in selected:
+            if values is not None:
+                filled |= pd.notna(values)
+        row_count = int(np.flatnonzero(filled)[-1]) + 1 if filled.any() else 0
+        columns['konto'] = columns['konto'][:row_count]
+        if columns['bezeichnung'] is not None:
+            columns['bezeichnung'] = columns['bezeichnung'][:row_count]
+        columns['months'] = {month: values[:row_count] for month, values in columns['months'].items()}
+        return layout, columns
+    
+    @staticmethod
+    def _normalize_xls_values(values: List, types: List) -> np.ndarray:
+        """xlrd değerlerini xlsx yolundaki gibi normalize eder: boş/hatalı hücreler None, tam sayılar int"""
+        import xlrd
+        result = np.array(values, dtype=object)
+        types = np.asarray(types)
+        result[np.isin(types, (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR))] = None
+        
+        numbers = np.flatnonzero(types == xlrd.XL_CELL_NUMBER)
+        if numbers.size:
+            numeric = result[numbers].astype(float)
+            integral = numbers[numeric == np.floor(numeric)]
+            result[integral] = [int(v) for v in numeric[numeric == np.floor(numeric)]]
+        return result
+    
+    def _build_bwa_data(self, columns: Dict) -> pd.DataFrame:
+        """Seçilen sütunlardan normalize edilmiş BWA DataFrame'ini oluşturur"""
+        konto_text = self._clean_text_column(columns['konto'])
+        
+        # Konto ve Bezeichnung'u birleştir
+        if columns['bezeichnung'] is not None:
+            # FORMAT 2: Ayrı sütunlar
+            bez_text = self._clean_text_column(columns['bezeichnung'])
+            combined = (konto_text + ' ' + bez_text).str.strip()
+        else:
+            # FORMAT 1: Tek sütun
+            combined = konto_text
+        
+        new_df = pd.DataFrame({'Konto_Bezeichnung': combined.to_numpy(dtype=object)})
+        
+        # Ay sütunlarını ekle (float64, boş hücreler NaN)
+        for month, values in columns['months'].items():
+            new_df[month] = self._parse_amounts(values)
+        
+        return new_df
+    
+    @staticmethod
+    def _parse_amounts(values) -> np.ndarray:
+        """Ay değerlerini float64'e çevirir; "1.234,56" gibi Almanca yazımları ve boş hücreleri tanır"""
+        series = pd.Series(values, dtype=object)
+        is_text = series.map(type).eq(str).to_numpy()
+        amounts = pd.to_numeric(series.where(~is_text), errors='coerce').to_numpy(dtype=np.float64, copy=True)
+        
+        if is_text.any():
+            text = series[is_text].astype(str).str.replace(r'[\s\u00a0€]', '', regex=True)
+            # DATEV tarzı sondaki eksi işareti: "1.234,56-"
+            trailing_minus = text.str.endswith('-') & ~text.str.startswith('-')
+            text = text.str.rstrip('-').where(trailing_minus, text)
+            # Virgül varsa Almanca yazım: binlik noktaları at, virgülü ondalık noktası yap
+            german = text.str.contains(',', regex=False) | text.str.fullmatch(r'-?\d{1,3}(\.\d{3})+')
+            text = text.where(~german, text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+            parsed = pd.to_numeric(text, errors='coerce').to_numpy(dtype=np.float64, copy=True)
+            parsed[trailing_minus.to_numpy()] *= -1
+            amounts[is_text] = parsed
+        
+        return amounts
+    
+    @staticmethod
+    def _clean_text_column(values) -> pd.Series:
+        """Hücre değerlerini kırpılmış metne çevirir; boş ve 'nan' değerler '' olur"""
+        series = pd.Series(values, dtype=object)
+        text = series.where(series.notna(), '').astype(str).str.strip()
+        return text.mask(text == 'nan', '')
+    
+    def _detect_layout(self, top_block: np.ndarray) -> Dict:
+        """Üst bloktan müşteri satırını, header satırını ve sütunları vektörel olarak bulur"""
+        layout = {
+            'customer_info': None,
+            'header_row': -1,
+            'konto_col': -1,
+            'bezeichnung_col': -1,
+            'month_positions': {}
+        }
+        if top_block.size == 0:
+            return layout
+        
+        # Bloğu bir kez string'e çevir ve normalize et
+        present = pd.notna(top_block)
+        text = np.char.strip(np.where(present, top_block.astype(str), '').astype(str))
+        upper = np.char.upper(text)
+        
+        # Müşteri bilgisi: ilk 10 satır, ilk 5 sütun (satır öncelikli sıra)
+        customer_block = text[:10, :5]
+        cells = pd.Series(customer_block.ravel(), dtype=object)
+        # Boşlukla ayrılmış format: "111051 Sherzad Farman Jindi"
+        spaced = cells.str.extract(r'(?s)^(\d{4,})\s+(.+)$')
+        # Köşeli parantez format: "[1105] Sherzad Farman Jindi"
+        bracket = cells.str.extract(r'(?s)^\[(\d+)\]\s*(\S.*)$')
+        hits = np.flatnonzero((cells.str.len() > 6).to_numpy() & (spaced[0].notna() | bracket[0].notna()).to_numpy())
+        if hits.size:
+            idx = hits[0]
+            row_idx, col_idx = divmod(int(idx), customer_block.shape[1])
+            if pd.notna(spaced.iat[idx, 0]):
+                layout['customer_info'] = {"code": spaced.iat[idx, 0], "name": spaced.iat[idx, 1]}
+                print(f"Customer found at row {row_idx}, col {col_idx}: {layout['customer_info']}")
+            else:
+                layout['customer_info'] = {"code": bracket.iat[idx, 0], "name": bracket.iat[idx, 1]}
+                print(f"Customer found (bracket) at row {row_idx}, col {col_idx}: {layout['customer_info']}")
+        
+        # Header: ilk "KONTO" hücresinin satırı, aynı satırda ay başlığı da olmalı
+        konto_hits = np.flatnonzero(np.char.find(upper, 'KONTO').ravel() >= 0)
+        if konto_hits.size == 0:
+            return layout
+        header_row, konto_col = divmod(int(konto_hits[0]), upper.shape[1])
+        layout['konto_col'] = konto_col
+        
+        month_hits = upper[header_row][None, :] == np.array(MONTH_COLS)[:, None]
+        if not month_hits.any():
+            return layout
+        
+        layout['header_row'] = header_row
+        
+        # "Bezeichnung" sütunu: header satırına kadar ilk eşleşme
+        scanned = upper[:header_row + 1]
+        bez_hits = np.flatnonzero(((np.char.find(scanned, 'BEZEICHNUNG') >= 0) |
+                                   (np.char.find(scanned, 'DESCRIPTION') >= 0)).ravel())
+        if bez_hits.size:
+            layout['bezeichnung_col'] = int(bez_hits[0]) % upper.shape[1]
+        
+        # Her ay için header satırındaki ilk sütun
+        layout['month_positions'] = {
+            month: int(month_hits[i].argmax())
+            for i, month in enumerate(MONTH_COLS) if month_hits[i].any()
+        }
+        
+        print(f"Header found at row {header_row}")
+        print(f"  Konto col: {konto_col}, Bezeichnung col: {layout['bezeichnung_col']}")
+        return layout
+    
+    def _prepare_data(self):
+        """Yüklenen BWA'nın ay sütunlarını bir kez float64 matrisine çevirir"""
+        for month in self.available_months:
+            if self.bwa_data[month].dtype != np.float64:
+                self.bwa_data[month] = self._parse_amounts(self.bwa_data[month].to_numpy(dtype=object))
+        
+        self.month_positions = {month: i for i, month in enumerate(self.available_months)}
+        if self.available_months:
+            self.month_matrix = np.ascontiguousarray(self.bwa_data[self.available_months].to_numpy(dtype=np.float64))
+        else:
+            self.month_matrix = np.empty((len(self.bwa_data), 0))
+        self.month_mask = ~np.isnan(self.month_matrix)
+        self._build_search_index()
+    
+    def _build_search_index(self):
+        """Kural eşleştiricisi için satır metinlerini ve aralık/önek kuralları için hesap kodu indeksini oluşturur"""
+        self._row_texts = self.bwa_data['Konto_Bezeichnung'].astype(str).tolist()
+        self._rule_rows = None
+        self._selection = None
+        self._period_cache.clear()
+        self._period_table = None
+        
+        # Hesap kodu -> ilk satır ("6310 Miete" -> 6310)
+        codes = pd.Series(self._row_texts, dtype=object).str.extract(r'^(\d+)', expand=False).dropna()
+        codes = codes[~codes.duplicated()]
+        
+        # Aralık kuralları için sayısal, önek kuralları için metinsel sıralı kod dizileri
+        code_strings = codes.to_numpy().astype(str)
+        code_rows = codes.index.to_numpy(dtype=np.intp)
+        order = np.argsort(code_strings, kind='stable')
+        self._code_strings = code_strings[order]
+        self._code_string_rows = code_rows[order]
+        numeric = np.char.str_len(code_strings) <= 18
+        code_numbers = code_strings[numeric].astype(np.int64)
+        order = np.argsort(code_numbers, kind='stable')
+        self._code_numbers = code_numbers[order]
+        self._code_number_rows = code_rows[numeric][order]
+    
+    def extract_values_for_period(self, start_month: str, end_month: str,
+                                  fields: Optional[List[str]] = None) -> Dict:
+        """Seçilen dönem için EKS alanlarını hesaplar; fields verilirse sadece bu alanlar.
+        
+        Sonuçlar değiştirilemez (MappingProxyType/tuple) döner ve BWA, kural seti ve dönem
+        başına önbelleğe alınır; değiştirmek isteyen çağıran thaw_results kullanmalı.
+        """
         if self.bwa_data is None or self.bwa_data.empty:
             return {}
         
+        cache_key = (self.bwa_hash, self.rules_version, start_month, end_month,
+                     tuple(fields) if fields is not None else None)
+        if self.bwa_hash is not None and cache_key in self._period_cache:
+            self._period_cache.move_to_end(cache_key)
+            return self._period_cache[cache_key]
+        
+        results = self._freeze_results(self._compute_period(start_month, end_month, fields))
+        if self.bwa_hash is not None:
+            self._period_cache[cache_key] = results
+            while len(self._period_cache) > self.period_cache_size:
+                self._period_cache.popitem(last=False)
+        return results
+    
+    @staticmethod
+    def _freeze_results(results: Dict) -> MappingProxyType:
+        """Sonuç sözlüğünü salt okunur hale getirir (önbellekteki nesne paylaşıldığı için)"""
+        return MappingProxyType({
+            field: MappingProxyType({key: tuple(value) if isinstance(value, list) else value
+                                     for key, value in data.items()})
+            for field, data in results.items()
+        })
+    
+    @staticmethod
+    def thaw_results(results) -> Dict:
+        """Önbellekten gelen salt okunur sonuçların düzenlenebilir kopyası"""
+        return {
+            field: {key: list(value) if isinstance(value, tuple) else value for key, value in data.items()}
+            for field, data in results.items()
+        }
+    
+    def _compute_period(self, start_month: str, end_month: str, fields: Optional[List[str]]) -> Dict:
         # Monat-Indices bestimmen  
         month_order = ['JAN', 'FEB', 'MRZ', 'APR', 'MAI', 'JUN', 'JUL', 'AUG', 'SEP', 'OKT', 'NOV', 'DEZ']
         try:
@@ -480,79 +1514,233 @@ class BWAParser:
         # Nur verfügbare Monate verwenden
         selected_months = [m for m in selected_months if m in self.available_months]
         
-        results = {}
+        selection = self._selection_matrix()
+        if fields is not None:
+            selection = self._subset_selection(selection, fields)
+        sums, valid = self._field_month_sums(selection, [self.month_positions[m] for m in selected_months])
+        totals = np.where(valid, sums, 0.0).sum(axis=1)
+        if selected_months:
+            confidences = (valid.sum(axis=1) / len(selected_months) * 100).astype(int)
+        else:
+            confidences = np.zeros(len(selection['fields']), dtype=int)
         
-        for field, rule in self.mapping_rules.items():
-            extracted = self._extract_mapping(rule, selected_months)
-            confidence = self._calculate_confidence(extracted['values'])
-            
+        results = {}
+        for i, field in enumerate(selection['fields']):
+            rule = self.mapping_rules[field]
             results[field] = {
-                'values': extracted['values'],
-                'confidence': confidence,
+                'values': [v if ok else None for v, ok in zip(sums[i].tolist(), valid[i].tolist())],
+                'confidence': int(confidences[i]),
                 'source': rule.bwa_source,
                 'description': rule.description_de,
                 'months': selected_months,
-                'total': sum(v for v in extracted['values'] if v is not None)
+                'total': float(totals[i])
             }
         
         return results
     
-    def _extract_mapping(self, rule: MappingRule, months: List[str]) -> Dict:
-        if rule.calculation_type == "direct":
-            return self._find_direct_match(rule.bwa_source, months)
-        elif rule.calculation_type == "sum":
-            return self._sum_multiple_accounts(rule.source_accounts, months)
-        return {'values': [None] * len(months)}
+    def _selection_matrix(self) -> Dict:
+        """Kural setini seyrek bir alan x satır seçim matrisi (COO: field_idx, row_idx) olarak kodlar"""
+        if self._selection is None or self._selection['version'] != self.rules_version:
+            term_rows = self._resolve_rule_terms()
+            fields = list(self.mapping_rules)
+            field_idx, row_idx = [], []
+            summed = np.zeros(len(fields), dtype=bool)
+            
+            for i, field in enumerate(fields):
+                rule = self.mapping_rules[field]
+                summed[i] = rule.calculation_type == "sum"
+                rows = self._rule_rows_for(rule, term_rows)
+                field_idx.extend([i] * len(rows))
+                row_idx.extend(rows)
+            
+            self._selection = {
+                'version': self.rules_version,
+                'fields': fields,
+                'field_idx': np.array(field_idx, dtype=np.intp),
+                'row_idx': np.array(row_idx, dtype=np.intp),
+                'summed': summed
+            }
+        return self._selection
     
-    def _find_direct_match(self, search_term: str, months: List[str]) -> Dict:
-        try:
-            # İlk sütunu al (artık her zaman Konto+Bezeichnung kombinasyonu)
-            if 'Konto_Bezeichnung' in self.bwa_data.columns:
-                first_col = self.bwa_data['Konto_Bezeichnung'].astype(str)
-            else:
-                first_col = self.bwa_data.iloc[:, 0].astype(str)
-            
-            # Arama yap
-            mask = first_col.str.contains(search_term, case=False, na=False, regex=False)
-            
-            if mask.any():
-                row = self.bwa_data[mask].iloc[0]
-                values = []
-                for month in months:
-                    if month in self.bwa_data.columns:
-                        val = row[month]
-                        values.append(abs(float(val)) if pd.notna(val) and val != '' else None)
-                    else:
-                        values.append(None)
-                return {'values': values}
-        except Exception as e:
-            print(f"Error in _find_direct_match for '{search_term}': {e}")
+    def _rule_rows_for(self, rule: MappingRule, term_rows: Dict[str, Optional[int]]) -> List[int]:
+        """Kuralın beslendiği BWA satırları (bulunamayan terimler atlanır, aralık satırları tekrarsız eklenir)"""
+        rows = [term_rows[term] for term in self._rule_terms(rule) if term_rows.get(term) is not None]
+        if rule.account_ranges or rule.account_prefixes:
+            seen = set(rows)
+            for row in self._account_range_rows(rule):
+                if row not in seen:
+                    seen.add(row)
+                    rows.append(row)
+        return rows
+    
+    def _account_range_rows(self, rule: MappingRule) -> List[int]:
+        """Aralık ve önek kurallarını sıralı kod indeksinde ikili arama ile çözer"""
+        rows = []
+        for low, high in rule.account_ranges or []:
+            start = np.searchsorted(self._code_numbers, int(low), side='left')
+            end = np.searchsorted(self._code_numbers, int(high), side='right')
+            rows.extend(self._code_number_rows[start:end].tolist())
+        for prefix in rule.account_prefixes or []:
+            # Kodlar sadece rakamlardan oluşur; ':' karakteri '9'dan hemen sonra gelir
+            start = np.searchsorted(self._code_strings, prefix, side='left')
+            end = np.searchsorted(self._code_strings, prefix + ':', side='left')
+            rows.extend(self._code_string_rows[start:end].tolist())
+        return rows
+    
+    def _patch_selection(self, selection: Dict, rule: MappingRule, term_rows: Dict[str, Optional[int]]) -> Dict:
+        """Tek bir alanın seçim satırlarını değiştirir; diğer alanların girdileri aynen kalır"""
+        fields = list(selection['fields'])
+        summed = selection['summed'].copy()
+        if rule.eks_field in fields:
+            i = fields.index(rule.eks_field)
+        else:
+            i = len(fields)
+            fields.append(rule.eks_field)
+            summed = np.append(summed, False)
+        summed[i] = rule.calculation_type == "sum"
         
-        return {'values': [None] * len(months)}
+        keep = selection['field_idx'] != i
+        rows = self._rule_rows_for(rule, term_rows)
+        return {
+            'version': self.rules_version,
+            'fields': fields,
+            'field_idx': np.concatenate([selection['field_idx'][keep], np.full(len(rows), i, dtype=np.intp)]),
+            'row_idx': np.concatenate([selection['row_idx'][keep], np.array(rows, dtype=np.intp)]),
+            'summed': summed
+        }
+    
+    @staticmethod
+    def _subset_selection(selection: Dict, fields: List[str]) -> Dict:
+        """Seçim matrisinin sadece istenen alanları içeren alt kümesi"""
+        positions = {field: i for i, field in enumerate(selection['fields'])}
+        wanted = [positions[field] for field in fields if field in positions]
+        remap = np.full(len(selection['fields']), -1, dtype=np.intp)
+        remap[wanted] = np.arange(len(wanted))
+        keep = remap[selection['field_idx']] >= 0
+        return {
+            'version': selection['version'],
+            'fields': [selection['fields'][i] for i in wanted],
+            'field_idx': remap[selection['field_idx'][keep]],
+            'row_idx': selection['row_idx'][keep],
+            'summed': selection['summed'][wanted]
+        }
+    
+    def get_field_dependencies(self, field: str) -> Dict:
+        """Bir EKS alanının bağlı olduğu kural ve BWA satırları"""
+        rule = self.mapping_rules.get(field)
+        if rule is None or self.bwa_data is None:
+            return {'rule': rule, 'rows': []}
+        selection = self._selection_matrix()
+        i = selection['fields'].index(field)
+        rows = selection['row_idx'][selection['field_idx'] == i]
+        return {'rule': rule, 'rows': sorted(set(rows.tolist()))}
+    
+    def _field_month_counts(self, selection: Dict, month_cols: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Seçim matrisi x ay matrisi: her alan için aylık toplamlar ve dolu hücre sayıları"""
+        shape = (len(selection['fields']), len(month_cols))
+        rows = self.month_matrix[selection['row_idx']][:, month_cols]
+        filled = self.month_mask[selection['row_idx']][:, month_cols]
+        
+        sums = np.zeros(shape)
+        counts = np.zeros(shape)
+        np.add.at(sums, selection['field_idx'], np.where(filled, np.abs(rows), 0.0))
+        np.add.at(counts, selection['field_idx'], filled)
+        return sums, counts
+    
+    def _field_month_sums(self, selection: Dict, month_cols: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Seçim matrisi x ay matrisi: her alan için aylık toplamlar ve geçerlilik maskesi"""
+        sums, counts = self._field_month_counts(selection, month_cols)
+        
+        # 'direct': değeri olmayan ay None; 'sum': sadece hiçbir ayda değer yoksa hepsi None
+        valid = counts > 0
+        summed = selection['summed']
+        valid[summed] = counts[summed].sum(axis=1, keepdims=True) > 0
+        return sums, valid
+    
+    def _get_period_table(self) -> Dict:
+        """Tüm alanlar x tüm aylar tablosunu ve dolu ay/hücre sayılarının önek toplamlarını tek geçişte hesaplar"""
+        if self._period_table is None or self._period_table['version'] != self.rules_version:
+            selection = self._selection_matrix()
+            months = [m for m in MONTH_COLS if m in self.month_positions]
+            sums, counts = self._field_month_counts(selection, [self.month_positions[m] for m in months])
+            
+            def prefix(values: np.ndarray) -> np.ndarray:
+                # prefix[:, j] = ilk j ayın toplamı; pencere [s, e) = prefix[:, e] - prefix[:, s]
+                return np.hstack([np.zeros((values.shape[0], 1)), np.cumsum(values, axis=1)])
+            
+            self._period_table = {
+                'version': self.rules_version,
+                'fields': selection['fields'],
+                'summed': selection['summed'],
+                'months': months,
+                'month_order': [MONTH_COLS.index(m) for m in months],
+                'sums': sums,
+                'counts': counts,
+                'cum_filled': prefix((counts > 0).astype(float)),
+                'cum_counts': prefix(counts)
+            }
+        return self._period_table
+    
+    def period_values(self, start_month: str, end_month: str) -> Dict:
+        """Bir dönemin sonuçlarını önceden hesaplanmış tablodan okur (extract_values_for_period ile aynı biçim)"""
+        if self.bwa_data is None or self.bwa_data.empty:
+            return {}
+        if start_month not in MONTH_COLS or end_month not in MONTH_COLS:
+            return self.extract_values_for_period(start_month, end_month)
+        
+        table = self._get_period_table()
+        start = bisect.bisect_left(table['month_order'], MONTH_COLS.index(start_month))
+        end = max(start, bisect.bisect_right(table['month_order'], MONTH_COLS.index(end_month)))
+        num_months = end - start
+        selected_months = table['months'][start:end]
+        
+        filled = table['cum_filled'][:, end] - table['cum_filled'][:, start]
+        any_value = (table['cum_counts'][:, end] - table['cum_counts'][:, start]) > 0
+        summed = table['summed']
+        
+        valid = table['counts'][:, start:end] > 0
+        valid[summed] = any_value[summed, None]
+        if num_months:
+            filled = np.where(summed, np.where(any_value, num_months, 0), filled)
+            confidences = (filled / num_months * 100).astype(int)
+        else:
+            confidences = np.zeros(len(table['fields']), dtype=int)
+        
+        # Toplamlar pencere üzerinden doğrudan (en fazla 12 ay); extract_values_for_period ile bire bir aynı float
+        sums = table['sums'][:, start:end]
+        totals = np.where(valid, sums, 0.0).sum(axis=1)
+        
+        results = {}
+        for i, field in enumerate(table['fields']):
+            rule = self.mapping_rules[field]
+            results[field] = {
+                'values': [v if ok else None for v, ok in zip(sums[i].tolist(), valid[i].tolist())],
+                'confidence': int(confidences[i]),
+                'source': rule.bwa_source,
+                'description': rule.description_de,
+                'months': selected_months,
+                'total': float(totals[i])
+            }
+        return self._freeze_results(results)
     
-    def _sum_multiple_accounts(self, accounts: List[str], months: List[str]) -> Dict:
-        total_values = [0] * len(months)
-        found_any = False
-        
-        for account in accounts:
-            result = self._find_direct_match(account, months)
-            for i, val in enumerate(result['values']):
-                if val is not None:
-                    total_values[i] += val
-                    found_any = True
+    def compute_standard_periods(self) -> Dict[str, Dict]:
+        """Q1-Q4, H1/H2 ve tüm yıl sonuçlarını tek bir tablo geçişinden üretir.
         
-        return {'values': total_values if found_any else [None] * len(months)}
-    
-    def _calculate_confidence(self, values: List) -> int:
-        if not values:
-            return 0
-        non_null = sum(1 for v in values if v is not None)
-        return int((non_null / len(values)) * 100)
+        Alan x ay tablosu bir kez hesaplanır; her dönem bu tablonun bir penceresidir
+        (toplamlar extract_values_for_period ile bire bir aynı float).
+        """
+        if self.bwa_data is None or self.bwa_data.empty:
+            return {}
+        return {name: self.period_values(start, end) for name, (start, end) in STANDARD_PERIODS.items()}
     
-    def _find_unmapped_accounts(self) -> List[Dict]:
-        """BWA'da bulunan ama mapping'de olmayan hesap kodlarını bulur - DÜZELTİLMİŞ"""
+    def _find_unmapped_accounts(self, top_k: Optional[int] = None) -> List[Dict]:
+        """BWA'da bulunan ama mapping'de olmayan, tutarı en büyük k hesabı bulur (vektörel)"""
         if self.bwa_data is None or self.bwa_data.empty:
             return []
+        top_k = self.unmapped_top_k if top_k is None else top_k
+        if top_k <= 0:
+            # AI önerisi istenmiyor; np.partition k=0 ile IndexError verirdi
+            return []
         
         # Mevcut mapping'deki tüm hesap kodlarını topla
         mapped_accounts = set()
@@ -560,92 +1748,182 @@ class BWAParser:
             if rule.source_accounts:
                 mapped_accounts.update(rule.source_accounts)
             mapped_accounts.add(rule.bwa_source)
+        # Aralık/önek kurallarının kapsadığı hesaplar da eşleştirilmiş sayılır
+        mapped_ranges = [(int(low), int(high)) for rule in self.mapping_rules.values()
+                         for low, high in rule.account_ranges or []]
+        mapped_prefixes = tuple(prefix for rule in self.mapping_rules.values()
+                                for prefix in rule.account_prefixes or [])
         
         unmapped = []
         try:
-            first_col = self.bwa_data.iloc[:, 0].astype(str)
-            second_col = self.bwa_data.iloc[:, 1].astype(str) if self.bwa_data.shape[1] > 1 else pd.Series()
+            # 4-stellige Kontonummern: tüm sütun için tek seferde ayıkla
+            parts = self.bwa_data['Konto_Bezeichnung'].astype(str).str.extract(r'^(\d{4})(?!\d)\s*(.*)$')
+            codes = parts[0]
             
-            for idx in range(len(first_col)):
-                text = first_col.iloc[idx]
-                description = second_col.iloc[idx] if idx < len(second_col) else ""
-                
-                # 4-stellige Kontonummern veya önemli satırları bul
-                account_match = re.match(r'^(\d{4})\s*(.*)$', text)
-                if not account_match:
-                    if text.isdigit() and len(text) == 4:
-                        account_code = text
-                        account_desc = description
-                    else:
-                        continue
-                else:
-                    account_code = account_match.group(1)
-                    account_desc = account_match.group(2) if account_match.group(2) else description
-                
-                # Bu hesap zaten eşleştirilmiş mi?
-                if account_code not in mapped_accounts:
-                    # Bu satırda değerler var mı kontrol et
-                    row_values = []
-                    for month in self.available_months[:6]:
-                        if month in self.bwa_data.columns:
-                            val = self.bwa_data.iloc[idx][month]
-                            if pd.notna(val) and val != '' and val != 0:
-                                row_values.append(abs(float(val)))
-                            else:
-                                row_values.append(0)
-                    
-                    # Sadece değeri olan hesapları ekle
-                    if any(v != 0 for v in row_values):
-                        unmapped.append({
-                            'account': account_code,
-                            'description': account_desc[:100],
-                            'values': row_values
-                        })
-                        print(f"Unmapped account found: {account_code} - {account_desc[:50]}")
+            # Eşleştirilmiş kümeyle anti-join
+            candidates = codes.notna() & ~codes.isin(mapped_accounts)
+            if mapped_prefixes:
+                candidates &= ~codes.str.startswith(mapped_prefixes).fillna(False).astype(bool)
+            if mapped_ranges:
+                numbers = pd.to_numeric(codes, errors='coerce')
+                for low, high in mapped_ranges:
+                    candidates &= ~numbers.between(low, high).to_numpy()
+            
+            # İlk altı ayın mutlak değerleri sayısal matristen; boş hücreler 0
+            month_cols = [self.month_positions[m] for m in self.available_months[:6] if m in self.month_positions]
+            values = np.abs(np.nan_to_num(self.month_matrix[:, month_cols]))
+            magnitudes = values.sum(axis=1)
+            
+            # Sadece değeri olan hesaplar
+            rows = np.flatnonzero(candidates.to_numpy() & (values != 0).any(axis=1))
+            row_magnitudes = magnitudes[rows]
+            
+            # Kısmi sıralama ile en büyük k; eşit tutarlarda önceki satır kazanır
+            if len(rows) > top_k:
+                kth = np.partition(row_magnitudes, len(rows) - top_k)[len(rows) - top_k]
+                keep = row_magnitudes > kth
+                ties = np.flatnonzero(row_magnitudes == kth)[:top_k - int(keep.sum())]
+                keep[ties] = True
+                rows, row_magnitudes = rows[keep], row_magnitudes[keep]
+            rows = rows[np.lexsort((rows, -row_magnitudes))]
+            
+            descriptions = parts[1].fillna('').to_numpy()
+            for idx in rows.tolist():
+                unmapped.append({
+                    'account': codes.iat[idx],
+                    'description': descriptions[idx][:100],
+                    'values': values[idx].tolist()
+                })
+                print(f"Unmapped account found: {codes.iat[idx]} - {descriptions[idx][:50]}")
         
         except Exception as e:
             print(f"Error finding unmapped accounts: {e}")
             import traceback
             traceback.print_exc()
         
-        # En önemli 5 hesabı döndür
-        unmapped.sort(key=lambda x: sum(abs(v) for v in x['values']), reverse=True)
-        return unmapped[:5]
+        return unmapped
     
-    def load_data_from_json(self, json_data: str, customer_info: Dict) -> Tuple[bool, str]:
-        """Kaydedilmiş JSON verisinden BWA DataFrame'ini yeniden oluşturur."""
+    def load_data_from_snapshot(self, bwa_data: pd.DataFrame, customer_info: Dict, snapshot_hash: str = None) -> Tuple[bool, str]:
+        """Geçmişten (SnapshotStore) gelen DataFrame'i yükler; ay sütunları zaten float64 olduğundan parse gerekmez."""
         try:
-            # Kayıtlı JSON'dan DataFrame'i geri yükle
-            self.bwa_data = pd.read_json(json_data, orient='split')
+            self.bwa_data = bwa_data
+            self.bwa_hash = snapshot_hash
             self.customer_info = customer_info
             
             # Mevcut ayları yeniden hesapla
             month_cols = ['JAN', 'FEB', 'MRZ', 'APR', 'MAI', 'JUN', 'JUL', 'AUG', 'SEP', 'OKT', 'NOV', 'DEZ']
             self.available_months = [col for col in self.bwa_data.columns if col in month_cols]
+            self._prepare_data()
             
             return True, f"BWA aus Verlauf geladen: {len(self.available_months)} Monate verfügbar"
         except Exception as e:
             self.bwa_data = None
+            self.bwa_hash = None
             self.customer_info = None
             self.available_months = []
             return False, f"Fehler beim Laden aus Verlauf: {str(e)}"
     
+    def run_mapping(self, start_month: str, end_month: str, progress_callback=None) -> Dict:
+        """Otomatik eşleştirmenin tamamı (arayüzsüz): dönem değerleri + eşleştirilmemiş hesaplar için öneriler.
+        
+        perform_mapping ve benchmark_mapping.py bu metodu kullanır.
+        """
+        # Temel eşleştirme
+        extracted = self.thaw_results(self.extract_values_for_period(start_month, end_month))
+        
+        # Progress güncelle
+        if progress_callback:
+            progress_callback(0.6, "Claude AI Vorschläge werden abgerufen...")
+        
+        # Önce yerel öneriler; Claude API aktifse sadece emin olunamayan hesaplar için
+        ai_available = self.claude_api and self.claude_api.is_available()
+        unmapped = self._find_unmapped_accounts()
+        if unmapped:
+            print(f"Found {len(unmapped)} unmapped accounts, getting suggestions...")
+            suggestions = self.get_mapping_suggestions(unmapped)
+            if suggestions:
+                extracted['_ai_suggestions'] = suggestions
+                print(f"Got {len(suggestions)} suggestions")
+            elif ai_available:
+                # AI'dan öneri gelmediyse (geçersiz anahtar vb.) durumu not et
+                extracted['_ai_status'] = "AI önerileri alınamadı. API anahtarı geçersiz olabilir."
+                print("No AI suggestions received (API key may be invalid)")
+            else:
+                # API hiç yapılandırılmadıysa durumu not et
+                extracted['_ai_status'] = "Claude AI aktif değil. Ayarlardan API anahtarınızı girin."
+                print("Claude API not configured or not available")
+        else:
+            # Eşleştirilecek yeni hesap bulunamadıysa durumu not et
+            extracted['_ai_status'] = "Tüm hesaplar eşleştirilmiş görünüyor."
+        
+        return extracted
+    
+    def get_mapping_suggestions(self, unmapped_accounts: List[Dict]) -> List[Dict]:
+        """Eşleştirilmemiş hesaplar için öneriler: önce yerel motor, sadece düşük güvenliler için AI.
+        
+        Sonuçlar giriş sırasındadır; AI yoksa veya cevap vermezse yerel öneri (varsa) kullanılır.
+        """
+        local_results = [self.local_suggester.suggest(account['account'], account['description'],
+                                                      list(self.mapping_rules.values()))
+                         for account in unmapped_accounts]
+        # Eşik dahil değildir: tam eşik değerindeki öneri de AI'ya sorulur
+        uncertain = [account for account, result in zip(unmapped_accounts, local_results)
+                     if result['confidence'] <= self.local_confidence_threshold]
+        print(f"Local suggestions: {len(unmapped_accounts) - len(uncertain)} confident, {len(uncertain)} for AI")
+        
+        ai_by_account = {}
+        if uncertain and self.claude_api and self.claude_api.is_available():
+            ai_by_account = {s['bwa_account']: s for s in self._get_ai_suggestions(uncertain)}
+        
+        suggestions = []
+        for account, local in zip(unmapped_accounts, local_results):
+            if account['account'] in ai_by_account:
+                suggestion = dict(ai_by_account[account['account']], source='ai')
+            elif local['suggestion']:
+                suggestion = {
+                    'bwa_account': account['account'],
+                    'bwa_description': account['description'],
+                    'suggested_eks': local['suggestion'],
+                    'confidence': local['confidence'],
+                    'reason': local['reason'],
+                    'values': account['values'],
+                    'source': 'local'
+                }
+            else:
+                continue
+            suggestions.append(suggestion)
+        return suggestions
+    
     def _get_ai_suggestions(self, unmapped_accounts: List[Dict]) -> List[Dict]:
-        """Claude API'den eşleştirme önerileri al - DÜZELTİLMİŞ"""
+        """Claude API'den eşleştirme önerileri al - tüm hesaplar tek istekte.
+        
+        Toplu yanıtta parse edilemeyen hesaplar tek tek (paralel, toplam süre sınırlı) sorulur.
+        Sonuçlar giriş sırasında döner; süre dolduğunda biten isteklerin sonuçları yine kullanılır.
+        """
         if not self.claude_api or not self.claude_api.is_available():
             print("Claude API not available")
             return []
+        if not unmapped_accounts:
+            return []
         
-        suggestions = []
+        # Toplu istek ve tek tek sorma aynı süre sınırını paylaşır
+        deadline = time.monotonic() + self.ai_deadline
+        print(f"Getting AI suggestions for {len(unmapped_accounts)} accounts in one request...")
+        results = self.claude_api.suggest_mappings_batch(unmapped_accounts, timeout=self.ai_deadline,
+                                                         deadline=deadline)
         
-        for account in unmapped_accounts:
-            print(f"Getting AI suggestion for account {account['account']}...")
-            
-            suggestion = self.claude_api.suggest_mapping(
-                account['account'], 
-                account['description'],
-                f"Monatswerte: {account['values'][:3]}"
-            )
+        retry = [i for i, result in enumerate(results) if result is None]
+        if retry and deadline - time.monotonic() <= 0:
+            print(f"  -> {len(retry)} accounts missing in batch answer, no time left to ask one by one")
+        elif retry:
+            print(f"  -> {len(retry)} accounts missing in batch answer, asking one by one")
+            for i, result in zip(retry, self._suggest_individually([unmapped_accounts[i] for i in retry], deadline)):
+                results[i] = result
+        
+        suggestions = []
+        for account, suggestion in zip(unmapped_accounts, results):
+            if suggestion is None:
+                continue
             
             if suggestion.get('suggestion'):
                 suggestions.append({
@@ -656,27 +1934,412 @@ class BWAParser:
                     'reason': suggestion.get('reason', ''),
                     'values': account['values']
                 })
-                print(f"  -> Suggested: {suggestion['suggestion']} ({suggestion.get('confidence', 0)}%)")
+                print(f"  -> {account['account']} suggested: {suggestion['suggestion']} ({suggestion.get('confidence', 0)}%)")
             else:
-                print(f"  -> No suggestion: {suggestion.get('reason', 'Unknown')}")
+                print(f"  -> {account['account']} no suggestion: {suggestion.get('reason', 'Unknown')}")
         
+        # Tek tek sorulan hesapların yeni kayıtları burada bir kez yazılır
+        self.claude_api.cache.save()
+        print(f"AI suggestion cache: {self.claude_api.cache.stats()}")
         return suggestions
+    
+    def _suggest_individually(self, accounts: List[Dict], deadline: Optional[float] = None) -> List[Optional[Dict]]:
+        """Hesap başına istekler (paralel, ai_max_in_flight ile sınırlı); süresi dolanlar için None.
+        
+        deadline time.monotonic() cinsindendir; verilmezse şimdiden itibaren ai_deadline kullanılır.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.ai_deadline
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.ai_max_in_flight, len(accounts))),
+                                      thread_name_prefix="ai-suggest")
+        futures = []
+        for account in accounts:
+            print(f"Getting AI suggestion for account {account['account']}...")
+            futures.append(executor.submit(
+                self.claude_api.suggest_mapping,
+                account['account'], 
+                account['description'],
+                f"Monatswerte: {account['values'][:3]}",
+                deadline
+            ))
+        
+        wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        # Henüz başlamamış istekleri iptal et; çalışanlar kendi timeout'larıyla arka planda biter
+        executor.shutdown(wait=False, cancel_futures=True)
+        
+        results = []
+        for account, future in zip(accounts, futures):
+            if not future.done() or future.cancelled():
+                print(f"  -> {account['account']}: no answer before deadline ({self.ai_deadline:.0f}s), skipped")
+                results.append(None)
+                continue
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"  -> {account['account']}: request failed: {e}")
+                results.append(None)
+        return results
+
+class BWASnapshotCodec:
+    """BWA DataFrame'i için sıkıştırılmış sütunsal anlık görüntü biçimi.
+    
+    zlib içinde: başlık uzunluğu + JSON başlık, ay matrisi (sütun sütun), her metin sütunu için UTF-8 uzunlukları + metin.
+    Tutarlar kuruşa tam bölünüyorsa boş hücre maskesi + int32 kuruş (bayt düzlemleri ayrılmış), değilse float64.
+    Eski to_json(orient='split') verisi de okunur.
+    """
+    
+    MAGIC = b"EKSBWA\x01\n"
+    
+    @staticmethod
+    def _encode_amounts(matrix: np.ndarray) -> Tuple[str, bytes]:
+        missing = np.isnan(matrix)
+        values = matrix[~missing]
+        cents = np.round(values * 100)
+        if values.size == 0 or (np.abs(cents).max() < 2 ** 31 and np.array_equal(cents / 100, values)):
+            cents = cents.astype('<i4')
+            # Aynı bayt konumları yan yana gelince zlib çok daha iyi sıkıştırır
+            planes = cents.view(np.uint8).reshape(-1, 4).T.tobytes()
+            return "cents", np.packbits(missing).tobytes() + planes
+        return "float64", matrix.tobytes()
+    
+    @staticmethod
+    def _decode_amounts(encoding: str, raw: bytes, offset: int, shape: Tuple[int, int]) -> Tuple[np.ndarray, int]:
+        size = shape[0] * shape[1]
+        if encoding == "float64":
+            matrix = np.frombuffer(raw, dtype='<f8', count=size, offset=offset).reshape(shape).astype(np.float64)
+            return matrix, offset + size * 8
+        
+        mask_bytes = (size + 7) // 8
+        missing = np.unpackbits(np.frombuffer(raw, dtype=np.uint8, count=mask_bytes, offset=offset), count=size).astype(bool)
+        offset += mask_bytes
+        count = size - int(missing.sum())
+        planes = np.frombuffer(raw, dtype=np.uint8, count=count * 4, offset=offset)
+        cents = planes.reshape(4, count).T.copy().view('<i4').ravel()
+        matrix = np.full(size, np.nan)
+        matrix[~missing] = cents / 100
+        return matrix.reshape(shape), offset + count * 4
+    
+    @classmethod
+    def encode(cls, bwa_data: pd.DataFrame) -> Tuple[str, bytes]:
+        """(içerik hash'i, ikili veri); hash sıkıştırma ve kodlamadan bağımsız, içerikten hesaplanır"""
+        numeric = [col for col in bwa_data.columns if pd.api.types.is_float_dtype(bwa_data[col])]
+        text = [col for col in bwa_data.columns if col not in numeric]
+        matrix = np.ascontiguousarray(bwa_data[numeric].to_numpy(dtype='<f8').T).reshape(len(numeric), len(bwa_data))
+        
+        text_parts = []
+        missing = {}
+        for col in text:
+            series = bwa_data[col]
+            encoded = [value.encode('utf-8') for value in series.fillna('').astype(str).tolist()]
+            text_parts.append(np.array([len(value) for value in encoded], dtype='<u4').tobytes())
+            text_parts.append(b''.join(encoded))
+            missing[str(col)] = np.flatnonzero(series.isna().to_numpy(dtype=bool)).tolist()
+        
+        header = {
+            "rows": len(bwa_data),
+            "columns": [str(col) for col in bwa_data.columns],
+            "numeric": [str(col) for col in numeric],
+            "missing": missing
+        }
+        digest = hashlib.sha256(json.dumps(header, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+        digest.update(matrix.tobytes())
+        for part in text_parts:
+            digest.update(part)
+        
+        header["amounts"], amounts = cls._encode_amounts(matrix)
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        body = b''.join([len(header_bytes).to_bytes(4, 'little'), header_bytes, amounts] + text_parts)
+        return digest.hexdigest(), cls.MAGIC + zlib.compress(body, 6)
+    
+    @classmethod
+    def decode(cls, payload) -> pd.DataFrame:
+        """İkili ya da eski JSON anlık görüntüden DataFrame"""
+        if isinstance(payload, bytes) and not payload.startswith(cls.MAGIC):
+            payload = payload.decode('utf-8')
+        if isinstance(payload, str):
+            return pd.read_json(io.StringIO(payload), orient='split')
+        
+        raw = zlib.decompress(payload[len(cls.MAGIC):])
+        header_length = int.from_bytes(raw[:4], 'little')
+        header = json.loads(raw[4:4 + header_length].decode('utf-8'))
+        rows = header["rows"]
+        numeric = header["numeric"]
+        matrix, offset = cls._decode_amounts(header["amounts"], raw, 4 + header_length, (len(numeric), rows))
+        
+        data = {}
+        for col in header["columns"]:
+            if col in numeric:
+                data[col] = matrix[numeric.index(col)]
+                continue
+            lengths = np.frombuffer(raw, dtype='<u4', count=rows, offset=offset).tolist()
+            offset += rows * 4
+            values = []
+            for length in lengths:
+                values.append(raw[offset:offset + length].decode('utf-8'))
+                offset += length
+            values = np.array(values, dtype=object)
+            values[header["missing"].get(col, [])] = np.nan
+            data[col] = values
+        return pd.DataFrame(data, columns=header["columns"])
+
+class SnapshotStore:
+    """BWA anlık görüntülerini içerik hash'iyle ayrı dosyalarda saklar; aynı içerik bir kez yazılır.
+    Yeni kayıtlar BWASnapshotCodec ile .bwa, eski kayıtlar .json olarak durur."""
+    
+    def __init__(self, store_dir: str = os.path.join("data", "snapshots")):
+        self.store_dir = store_dir
+        self._lock = threading.Lock()
+        os.makedirs(store_dir, exist_ok=True)
+    
+    def _blob_path(self, snapshot_hash: str, extension: str = ".bwa") -> str:
+        return os.path.join(self.store_dir, snapshot_hash[:2], f"{snapshot_hash}{extension}")
+    
+    def _write(self, path: str, payload: bytes):
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)
+    
+    def put_frame(self, bwa_data: pd.DataFrame) -> str:
+        """DataFrame'i ikili biçimde saklar ve içerik hash'ini döndürür (zaten varsa yeniden yazılmaz)"""
+        snapshot_hash, payload = BWASnapshotCodec.encode(bwa_data)
+        self._write(self._blob_path(snapshot_hash), payload)
+        return snapshot_hash
+    
+    def put(self, bwa_data_json: str) -> str:
+        """Eski biçimdeki (JSON) anlık görüntüyü olduğu gibi saklar"""
+        snapshot_hash = hashlib.sha256(bwa_data_json.encode('utf-8')).hexdigest()
+        self._write(self._blob_path(snapshot_hash, ".json"), bwa_data_json.encode('utf-8'))
+        return snapshot_hash
+    
+    def get(self, snapshot_hash: str) -> Optional[bytes]:
+        for extension in (".bwa", ".json"):
+            try:
+                with open(self._blob_path(snapshot_hash, extension), 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                continue
+        return None
+    
+    def load_frame(self, snapshot_hash: str) -> Optional[pd.DataFrame]:
+        payload = self.get(snapshot_hash)
+        return BWASnapshotCodec.decode(payload) if payload is not None else None
+    
+    def remove(self, snapshot_hash: str) -> bool:
+        """Tek bir anlık görüntüyü (her iki biçimde) siler"""
+        removed = False
+        with self._lock:
+            for extension in (".bwa", ".json"):
+                try:
+                    os.remove(self._blob_path(snapshot_hash, extension))
+                    removed = True
+                except OSError:
+                    pass
+        return removed
+    
+    def remove_unreferenced(self, referenced: set) -> int:
+        """Hiçbir müşteri kaydının göstermediği anlık görüntüleri siler (tüm depo taranır)"""
+        removed = 0
+        with self._lock:
+            for root, _, files in os.walk(self.store_dir):
+                for file_name in files:
+                    snapshot_hash = file_name.split('.')[0]
+                    if file_name.endswith(('.bwa', '.json')) and snapshot_hash not in referenced:
+                        try:
+                            os.remove(os.path.join(root, file_name))
+                            removed += 1
+                        except OSError:
+                            pass
+        return removed
 
 class CustomerManager:
     def __init__(self, data_dir: str = "data"):
         self.data_dir = data_dir
         self.customers_dir = os.path.join(data_dir, "customers")
         os.makedirs(self.customers_dir, exist_ok=True)
+        # BWA yükleme verisi müşteri dosyasında değil, ayrı bir blob deposunda (müşteride sadece hash)
+        self.snapshot_store = SnapshotStore(os.path.join(data_dir, "snapshots"))
+        # Listeleme için hafif indeks: kod, isim, oluşturma tarihi, geçmiş sayısı, dosya mtime
+        self.index_path = os.path.join(data_dir, "customer_index.json")
+        self._index = None
+        self._index_lock = threading.Lock()
         
     def save_customer(self, customer: Customer) -> bool:
+        return self._write_customer_data(asdict(customer))
+    
+    def _write_customer_data(self, data: Dict) -> bool:
         try:
-            file_path = os.path.join(self.customers_dir, f"{customer.code}.json")
+            file_path = os.path.join(self.customers_dir, f"{data['code']}.json")
             with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(asdict(customer), f, ensure_ascii=False, indent=2)
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            self._update_index_entry(data['code'], data, os.stat(file_path))
             return True
         except Exception:
             return False
     
+    @staticmethod
+    def _index_entry(data: Dict, stat: os.stat_result) -> Dict:
+        return {
+            "code": data.get("code"),
+            "name": data.get("name", ""),
+            "created_date": data.get("created_date", ""),
+            "history_count": len(data.get("bwa_upload_history", [])),
+            "snapshots": sorted({entry['snapshot'] for entry in data.get("bwa_upload_history", []) if 'snapshot' in entry}),
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size
+        }
+    
+    def _load_index(self) -> Dict[str, Dict]:
+        if self._index is None:
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except FileNotFoundError:
+                self._index = {}
+            except Exception as e:
+                print(f"Customer index unreadable, rebuilding: {e}")
+                self._index = {}
+        return self._index
+    
+    def _save_index(self):
+        try:
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._index, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            print(f"Customer index write error: {e}")
+    
+    def _update_index_entry(self, customer_code: str, data: Dict, stat: os.stat_result):
+        with self._index_lock:
+            self._load_index()[customer_code] = self._index_entry(data, stat)
+            self._save_index()
+    
+    def _refresh_index(self) -> Dict[str, Dict]:
+        """İndeksi dosya mtime/boyutlarıyla karşılaştırır; sadece değişen müşteri dosyaları okunur"""
+        with self._index_lock:
+            index = self._load_index()
+            changed = False
+            seen = set()
+            for entry in os.scandir(self.customers_dir):
+                if not entry.name.endswith('.json'):
+                    continue
+                customer_code = entry.name[:-5]
+                seen.add(customer_code)
+                stat = entry.stat()
+                cached = index.get(customer_code)
+                if (cached and cached.get("mtime") == stat.st_mtime_ns and cached.get("size") == stat.st_size
+                        and "snapshots" in cached):
+                    continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    data.setdefault("code", customer_code)
+                    index[customer_code] = self._index_entry(data, stat)
+                except Exception as e:
+                    print(f"Error indexing customer {customer_code}: {e}")
+                    index.pop(customer_code, None)
+                changed = True
+            
+            for customer_code in set(index) - seen:
+                del index[customer_code]
+                changed = True
+            
+            if changed:
+                self._save_index()
+            return dict(index)
+    
+    def list_customers(self) -> List[Dict]:
+        """Müşteri listesi sadece indeksten (kod sırasına göre); müşteri dosyaları açılmaz"""
+        return sorted(self._refresh_index().values(), key=lambda entry: entry["code"])
+    
+    def add_bwa_upload(self, customer: Customer, file_name: str, bwa_data: pd.DataFrame, customer_info: Optional[Dict]) -> bool:
+        """Yüklenen BWA'yı depoya koyar, müşteriye sadece meta veri + hash ekler"""
+        snapshot_hash = self.snapshot_store.put_frame(bwa_data)
+        customer.bwa_upload_history.append({
+            "date": datetime.now().strftime("%Y-%m-%d %H:%M"), # Daha okunaklı tarih
+            "file_name": file_name,
+            "snapshot": snapshot_hash,
+            "customer_info": customer_info # Müşteri bilgisini de sakla
+        })
+        return self.save_customer(customer)
+    
+    def add_export(self, customer: Customer, history_entry: Dict) -> bool:
+        """Dışa aktarım geçmişine bir kayıt ekler"""
+        customer.bwa_history.append(history_entry)
+        return self.save_customer(customer)
+    
+    def load_bwa_snapshot(self, history_entry: Dict) -> Optional[pd.DataFrame]:
+        """Geçmiş kaydının BWA verisi; eski kayıtlarda veri kaydın içinde JSON olarak durur"""
+        if 'snapshot' in history_entry:
+            return self.snapshot_store.load_frame(history_entry['snapshot'])
+        if 'bwa_data_json' in history_entry:
+            return BWASnapshotCodec.decode(history_entry['bwa_data_json'])
+        return None
+    
+    def delete_bwa_upload(self, customer: Customer, history_entry: Dict) -> bool:
+        """Geçmiş kaydını siler; başka kayıtların kullanmadığı anlık görüntü de silinir"""
+        customer.bwa_upload_history.remove(history_entry)
+        saved = self.save_customer(customer)
+        if saved and 'snapshot' in history_entry and not self._snapshot_referenced(history_entry['snapshot']):
+            self.snapshot_store.remove(history_entry['snapshot'])
+        return saved
+    
+    def _snapshot_referenced(self, snapshot_hash: str) -> bool:
+        """Hash'i kullanan bir müşteri var mı; indeksten bakılır, sadece değişen müşteri dosyaları okunur"""
+        return any(snapshot_hash in entry.get("snapshots", ()) for entry in self._refresh_index().values())
+    
+    def collect_garbage(self) -> int:
+        """Bakım: hiçbir kaydın göstermediği anlık görüntüleri siler; silinen dosya sayısını döndürür"""
+        referenced = self._referenced_snapshots()
+        if referenced is None:
+            return 0
+        return self.snapshot_store.remove_unreferenced(referenced)
+    
+    def _referenced_snapshots(self) -> Optional[set]:
+        """Tüm müşterilerin kullandığı hash'ler; okunamayan bir dosya varsa None (hiçbir şey silinmez)"""
+        referenced = set()
+        for file_name in os.listdir(self.customers_dir):
+            if file_name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.customers_dir, file_name), 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except Exception:
+                    return None
+                referenced.update(entry['snapshot'] for entry in data.get('bwa_upload_history', []) if 'snapshot' in entry)
+        return referenced
+    
+    @staticmethod
+    def _order_upload_history(history: List[Dict]) -> List[Dict]:
+        """Yükleme geçmişi eskiden yeniye sıralı tutulur (tarih, sonra ekleme sırası); yeni kayıtlar sona eklenir"""
+        return [entry for _, entry in sorted(enumerate(history), key=lambda item: (item[1].get('date', ''), item[0]))]
+    
+    @staticmethod
+    def recent_uploads(customer: Customer, limit: int = 10) -> List[Dict]:
+        """En yeni 'limit' yükleme kaydı, en yeni başta; aynı tarihliler ekleme sırasında kalır"""
+        if limit <= 0:
+            return []
+        history = customer.bwa_upload_history
+        start = max(0, len(history) - limit)
+        # Sınırdaki aynı tarihli grubun tamamı alınır, yoksa gruptan yanlış kayıtlar düşerdi
+        while 0 < start < len(history) and history[start - 1].get('date', '') == history[start].get('date', ''):
+            start -= 1
+        tail = history[start:]
+        order = sorted(range(len(tail)), key=lambda i: (tail[i].get('date', ''), -i), reverse=True)
+        return [tail[i] for i in order[:limit]]
+    
+    def _migrate_inline_snapshots(self, data: Dict) -> bool:
+        """Eski kayıtlardaki gömülü bwa_data_json verisini depoya taşır; değişiklik olduysa True"""
+        migrated = False
+        for entry in data.get('bwa_upload_history', []):
+            if 'bwa_data_json' in entry:
+                entry['snapshot'] = self.snapshot_store.put(entry.pop('bwa_data_json'))
+                migrated = True
+        return migrated
+    
     def load_customer(self, customer_code: str) -> Optional[Customer]:
             try:
                 file_path = os.path.join(self.customers_dir, f"{customer_code}.json")
@@ -689,6 +2352,13 @@ class CustomerManager:
                     if 'bwa_upload_history' not in data:
                         data['bwa_upload_history'] = []
                     # --- KONTROL SONU ---
+                    
+                    # Gömülü anlık görüntüleri bir kez depoya taşı, dosyayı küçült
+                    if self._migrate_inline_snapshots(data):
+                        self._write_customer_data(data)
+                        print(f"Customer {customer_code}: BWA snapshots moved to snapshot store")
+                    # Geçmiş sadece meta veri + hash; veri load_bwa_snapshot ile istendiğinde okunur
+                    data['bwa_upload_history'] = self._order_upload_history(data['bwa_upload_history'])
 
                     return Customer(**data)
             except Exception as e:
@@ -707,6 +2377,259 @@ class CustomerManager:
                     customers.append(customer)
         return sorted(customers, key=lambda c: c.code)
     
+class SQLiteCustomerManager(CustomerManager):
+    """Müşteri verisini tek bir SQLite veritabanında (WAL) saklar; CustomerManager ile aynı API.
+    settings.json: "storage_backend": "sqlite". Anlık görüntüler SnapshotStore'da kalır."""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS customers (
+            code TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            created_date TEXT,
+            default_template TEXT,
+            notes TEXT
+        );
+        CREATE TABLE IF NOT EXISTS uploads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_code TEXT NOT NULL REFERENCES customers(code) ON DELETE CASCADE,
+            date TEXT,
+            file_name TEXT,
+            snapshot TEXT,
+            entry TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_uploads_customer ON uploads(customer_code, date, id);
+        CREATE INDEX IF NOT EXISTS idx_uploads_date ON uploads(date);
+        CREATE INDEX IF NOT EXISTS idx_uploads_snapshot ON uploads(snapshot);
+        CREATE TABLE IF NOT EXISTS export_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_code TEXT NOT NULL REFERENCES customers(code) ON DELETE CASCADE,
+            processed_date TEXT,
+            entry TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_export_customer ON export_history(customer_code, id);
+        CREATE INDEX IF NOT EXISTS idx_export_date ON export_history(processed_date);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+    
+    def __init__(self, data_dir: str = "data", db_path: str = None):
+        super().__init__(data_dir)
+        self.db_path = db_path or os.path.join(data_dir, "customers.db")
+        self._db_lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(self.SCHEMA)
+        self.migrate_from_json()
+    
+    def close(self):
+        with self._db_lock:
+            self._conn.close()
+    
+    @staticmethod
+    def _entry_json(entry: Dict) -> str:
+        return json.dumps(entry, ensure_ascii=False, sort_keys=True)
+    
+    def _upsert_customer_row(self, data: Dict):
+        self._conn.execute(
+            """INSERT INTO customers (code, name, created_date, default_template, notes) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(code) DO UPDATE SET name=excluded.name, created_date=excluded.created_date,
+               default_template=excluded.default_template, notes=excluded.notes""",
+            (data['code'], data.get('name', ''), data.get('created_date', ''),
+             data.get('default_template', "eks_standard.xlsx"), data.get('notes', ""))
+        )
+    
+    def _insert_upload(self, customer_code: str, entry: Dict):
+        self._conn.execute(
+            "INSERT INTO uploads (customer_code, date, file_name, snapshot, entry) VALUES (?, ?, ?, ?, ?)",
+            (customer_code, entry.get('date'), entry.get('file_name'), entry.get('snapshot'), self._entry_json(entry))
+        )
+    
+    def _insert_export(self, customer_code: str, entry: Dict):
+        self._conn.execute(
+            "INSERT INTO export_history (customer_code, processed_date, entry) VALUES (?, ?, ?)",
+            (customer_code, entry.get('processed_date'), self._entry_json(entry))
+        )
+    
+    def _sync_history(self, table: str, customer_code: str, entries: List[Dict], insert):
+        """Sadece değişen geçmiş satırlarını yazar: artık olmayan satırlar silinir, yeniler eklenir"""
+        wanted = Counter(self._entry_json(entry) for entry in entries)
+        stale = []
+        for row in self._conn.execute(f"SELECT id, entry FROM {table} WHERE customer_code = ? ORDER BY id",
+                                      (customer_code,)):
+            if wanted[row['entry']] > 0:
+                wanted[row['entry']] -= 1
+            else:
+                stale.append((row['id'],))
+        if stale:
+            self._conn.executemany(f"DELETE FROM {table} WHERE id = ?", stale)
+        for entry in entries:
+            entry_json = self._entry_json(entry)
+            if wanted[entry_json] > 0:
+                wanted[entry_json] -= 1
+                insert(customer_code, entry)
+    
+    def _write_customer_data(self, data: Dict) -> bool:
+        """Müşteri satırını ve geçmişteki değişiklikleri tek bir işlemde yazar (değişmeyen satırlara dokunulmaz)"""
+        try:
+            with self._db_lock, self._conn:
+                self._upsert_customer_row(data)
+                self._sync_history("uploads", data['code'], data.get('bwa_upload_history', []), self._insert_upload)
+                self._sync_history("export_history", data['code'], data.get('bwa_history', []), self._insert_export)
+            return True
+        except Exception as e:
+            print(f"Error saving customer {data.get('code')}: {e}")
+            return False
+    
+    def append_upload(self, customer: Customer, history_entry: Dict) -> bool:
+        """Tek bir yükleme kaydı ekler; müşterinin diğer geçmişi yeniden yazılmaz"""
+        try:
+            with self._db_lock, self._conn:
+                self._upsert_customer_row(asdict(customer))
+                self._insert_upload(customer.code, history_entry)
+            customer.bwa_upload_history.append(history_entry)
+            return True
+        except Exception as e:
+            print(f"Error saving upload for {customer.code}: {e}")
+            return False
+    
+    def add_export(self, customer: Customer, history_entry: Dict) -> bool:
+        try:
+            with self._db_lock, self._conn:
+                self._upsert_customer_row(asdict(customer))
+                self._insert_export(customer.code, history_entry)
+            customer.bwa_history.append(history_entry)
+            return True
+        except Exception as e:
+            print(f"Error saving export history for {customer.code}: {e}")
+            return False
+    
+    def add_bwa_upload(self, customer: Customer, file_name: str, bwa_data: pd.DataFrame, customer_info: Optional[Dict]) -> bool:
+        return self.append_upload(customer, {
+            "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            "file_name": file_name,
+            "snapshot": self.snapshot_store.put_frame(bwa_data),
+            "customer_info": customer_info
+        })
+    
+    def delete_bwa_upload(self, customer: Customer, history_entry: Dict) -> bool:
+        try:
+            with self._db_lock, self._conn:
+                self._conn.execute(
+                    """DELETE FROM uploads WHERE id = (
+                           SELECT id FROM uploads WHERE customer_code = ? AND entry = ? ORDER BY id LIMIT 1)""",
+                    (customer.code, self._entry_json(history_entry))
+                )
+        except Exception as e:
+            print(f"Error deleting upload for {customer.code}: {e}")
+            return False
+        customer.bwa_upload_history.remove(history_entry)
+        if 'snapshot' in history_entry and not self._snapshot_referenced(history_entry['snapshot']):
+            self.snapshot_store.remove(history_entry['snapshot'])
+        return True
+    
+    def _snapshot_referenced(self, snapshot_hash: str) -> bool:
+        """Veritabanında (indeksli) ve yedek JSON dosyalarında hash'i kullanan kayıt var mı"""
+        with self._db_lock:
+            row = self._conn.execute("SELECT 1 FROM uploads WHERE snapshot = ? LIMIT 1", (snapshot_hash,)).fetchone()
+        return row is not None or super()._snapshot_referenced(snapshot_hash)
+    
+    def _referenced_snapshots(self) -> Optional[set]:
+        """Veritabanındaki hash'ler; yedek olarak duran JSON dosyalarının gösterdikleri de silinmez"""
+        json_referenced = super()._referenced_snapshots()
+        if json_referenced is None:
+            return None
+        with self._db_lock:
+            rows = self._conn.execute("SELECT DISTINCT snapshot FROM uploads WHERE snapshot IS NOT NULL").fetchall()
+        return json_referenced | {row['snapshot'] for row in rows}
+    
+    def _customer_from_rows(self, row: sqlite3.Row, uploads: List[Dict], exports: List[Dict]) -> Customer:
+        return Customer(code=row['code'], name=row['name'], created_date=row['created_date'],
+                        default_template=row['default_template'], notes=row['notes'],
+                        bwa_history=exports, bwa_upload_history=uploads)
+    
+    def load_customer(self, customer_code: str) -> Optional[Customer]:
+        try:
+            with self._db_lock:
+                row = self._conn.execute("SELECT * FROM customers WHERE code = ?", (customer_code,)).fetchone()
+                if row is None:
+                    return None
+                uploads = [json.loads(r['entry']) for r in self._conn.execute(
+                    "SELECT entry FROM uploads WHERE customer_code = ? ORDER BY date, id", (customer_code,))]
+                exports = [json.loads(r['entry']) for r in self._conn.execute(
+                    "SELECT entry FROM export_history WHERE customer_code = ? ORDER BY id", (customer_code,))]
+            return self._customer_from_rows(row, uploads, exports)
+        except Exception as e:
+            print(f"Error loading customer {customer_code}: {e}")
+            return None
+    
+    def get_all_customers(self) -> List[Customer]:
+        with self._db_lock:
+            rows = self._conn.execute("SELECT * FROM customers ORDER BY code").fetchall()
+            uploads = {row['code']: [] for row in rows}
+            exports = {row['code']: [] for row in rows}
+            for r in self._conn.execute("SELECT customer_code, entry FROM uploads ORDER BY customer_code, date, id"):
+                uploads[r['customer_code']].append(json.loads(r['entry']))
+            for r in self._conn.execute("SELECT customer_code, entry FROM export_history ORDER BY customer_code, id"):
+                exports[r['customer_code']].append(json.loads(r['entry']))
+        return [self._customer_from_rows(row, uploads[row['code']], exports[row['code']]) for row in rows]
+    
+    def list_customers(self) -> List[Dict]:
+        with self._db_lock:
+            rows = self._conn.execute(
+                """SELECT c.code, c.name, c.created_date,
+                          (SELECT COUNT(*) FROM uploads u WHERE u.customer_code = c.code) AS history_count
+                   FROM customers c ORDER BY c.code"""
+            ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def customers_with_uploads_in(self, year: int, month: int) -> List[str]:
+        """Verilen ayda BWA yüklemesi olan müşteri kodları (uploads.date indeksi üzerinden)"""
+        start = f"{year:04d}-{month:02d}"
+        end = f"{year + month // 12:04d}-{month % 12 + 1:02d}"
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT customer_code FROM uploads WHERE date >= ? AND date < ? ORDER BY customer_code",
+                (start, end)
+            ).fetchall()
+        return [row['customer_code'] for row in rows]
+    
+    def migrate_from_json(self) -> int:
+        """data/customers/*.json dosyalarını bir kez veritabanına aktarır; dosyalar yedek olarak kalır"""
+        with self._db_lock:
+            if self._conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone():
+                return 0
+            migrated = 0
+            with self._conn:
+                for file_name in sorted(os.listdir(self.customers_dir)):
+                    if not file_name.endswith('.json'):
+                        continue
+                    try:
+                        with open(os.path.join(self.customers_dir, file_name), 'r', encoding='utf-8') as f:
+                            data = json.load(f)
+                    except Exception as e:
+                        print(f"Customer file {file_name} skipped during migration: {e}")
+                        continue
+                    data.setdefault('code', file_name[:-5])
+                    if self._conn.execute("SELECT 1 FROM customers WHERE code = ?", (data['code'],)).fetchone():
+                        continue
+                    self._migrate_inline_snapshots(data)
+                    self._upsert_customer_row(data)
+                    for entry in self._order_upload_history(data.get('bwa_upload_history', [])):
+                        self._insert_upload(data['code'], entry)
+                    for entry in data.get('bwa_history', []):
+                        self._insert_export(data['code'], entry)
+                    migrated += 1
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)",
+                                   (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
+        if migrated:
+            print(f"{migrated} customers migrated from JSON files to {self.db_path}")
+        return migrated
+    
 class EKSFormFiller(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -723,16 +2646,21 @@ class EKSFormFiller(ctk.CTk):
         
         # Components
         self.bwa_parser = BWAParser()
-        self.customer_manager = CustomerManager()
+        self.bwa_parser.load_mapping_rules()
+        self.customer_manager = self.create_customer_manager()
         
         # State
         self.current_customer = None
         self.bwa_file_path = None
         self.extracted_data = {}
+        # Tabloda elle düzeltilen değerler: alan -> {ay: değer}; dönem değişse de korunur
+        self.manual_overrides = {}
         self.selected_start_month = "JAN"
         self.selected_end_month = "JUN"
         self.selected_year = datetime.now().year
         self.total_labels = {}
+        self.result_rows = {}
+        self.ai_suggestion_frames = {}
         
         # API Key'i yükle
         self.load_api_settings()
@@ -740,6 +2668,19 @@ class EKSFormFiller(ctk.CTk):
         self.setup_ui()
         self.load_customer_list()
     
+    def create_customer_manager(self) -> CustomerManager:
+        """Müşteri deposunu settings.json'daki storage_backend'e göre bir kez seçer (varsayılan JSON)"""
+        settings_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.json")
+        backend = None
+        try:
+            with open(settings_path, 'r', encoding='utf-8') as f:
+                backend = json.load(f).get("storage_backend")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Storage backend setting unreadable, using JSON: {e}")
+        return SQLiteCustomerManager() if backend == "sqlite" else CustomerManager()
+    
     def load_api_settings(self):
         """API ayarlarını yükle - DÜZELTİLMİŞ"""
         try:
@@ -747,10 +2688,13 @@ class EKSFormFiller(ctk.CTk):
             if os.path.exists(settings_path):
                 with open(settings_path, 'r', encoding='utf-8') as f:
                     settings = json.load(f)
+                    self.bwa_parser.ai_max_in_flight = int(settings.get("ai_max_in_flight", self.bwa_parser.ai_max_in_flight))
+                    self.bwa_parser.ai_deadline = float(settings.get("ai_deadline_seconds", self.bwa_parser.ai_deadline))
+                    self.bwa_parser.local_suggester.chart = settings.get("chart_of_accounts", self.bwa_parser.local_suggester.chart)
                     api_key = settings.get("claude_api_key", "")
                     if api_key:
                         print(f"Loading API key: {api_key[:20]}..." if len(api_key) > 20 else f"Loading API key")
-                        self.bwa_parser.set_claude_api(api_key)
+                        self.bwa_parser.set_claude_api(api_key, settings.get("claude_api_url"))
                         print("API key loaded successfully")
                     else:
                         print("No API key found in settings")
@@ -898,6 +2842,10 @@ class EKSFormFiller(ctk.CTk):
                                         command=self.perform_mapping, height=40, state="disabled")
         self.mapping_btn.pack(pady=20, padx=20, fill="x")
         
+        self.rule_btn = ctk.CTkButton(left_panel, text=self.texts["account_rule"],
+                                     command=self.open_rule_dialog, height=30)
+        self.rule_btn.pack(pady=5, padx=20, fill="x")
+        
         # Template Analyse Button (Debug)
         analyze_btn = ctk.CTkButton(left_panel, text="🔍 Template Analysieren",
                                   command=self.analyze_template_wrapper, height=30)
@@ -942,6 +2890,16 @@ class EKSFormFiller(ctk.CTk):
     def on_period_changed(self, value=None):
         self.selected_start_month = self.start_month_combo.get()
         self.selected_end_month = self.end_month_combo.get()
+        
+        # Eşleştirme sonuçları varsa yeni dönemi dönem tablosundan oku (yeniden çıkarım yok)
+        has_real_data = any(not key.startswith('_') for key in self.extracted_data)
+        if has_real_data and self.bwa_parser.bwa_data is not None:
+            period_data = self.bwa_parser.thaw_results(
+                self.bwa_parser.period_values(self.selected_start_month, self.selected_end_month))
+            period_data.update({key: value for key, value in self.extracted_data.items() if key.startswith('_')})
+            self.apply_manual_overrides(period_data)
+            self.extracted_data = period_data
+            self.display_mapping_results()
     
     def change_language(self, selected_language):
         """Dil değiştirme fonksiyonu"""
@@ -960,6 +2918,7 @@ class EKSFormFiller(ctk.CTk):
             # (Bu kısım zaten çalışıyor, ancak daha fazla eleman varsa buraya eklenebilir)
             self.load_bwa_btn.configure(text=self.texts["load_bwa"])
             self.mapping_btn.configure(text=self.texts["auto_mapping"])
+            self.rule_btn.configure(text=self.texts["account_rule"])
             self.export_btn.configure(text=self.texts["export_eks"])
             
             # Sol Panel Başlıkları
@@ -985,8 +2944,8 @@ class EKSFormFiller(ctk.CTk):
                 self.bwa_status_label.configure(text="✅ " + self.texts["file_loaded"])
     
     def load_customer_list(self):
-        customers = self.customer_manager.get_all_customers()
-        customer_options = [f"{c.code} - {c.name}" for c in customers]
+        customers = self.customer_manager.list_customers()
+        customer_options = [f"{c['code']} - {c['name']}" for c in customers]
         
         if customer_options:
             self.customer_combo.configure(values=customer_options)
@@ -1053,6 +3012,7 @@ class EKSFormFiller(ctk.CTk):
     def on_bwa_loaded(self, success: bool, message: str, file_path: str):
             if success:
                 self.bwa_file_path = file_path
+                self.manual_overrides = {}
                 self.bwa_status_label.configure(text="✅ " + self.texts["file_loaded"], text_color="green")
                 self.mapping_btn.configure(state="normal")
                 self.update_bwa_info()
@@ -1074,20 +3034,10 @@ class EKSFormFiller(ctk.CTk):
                 # --- GÜNCELLENMİŞ KAYDETME BÖLÜMÜ ---
                 # Yükleme geçmişini VERİ olarak kaydet
                 if self.current_customer:
-                    # pandas DataFrame'i JSON string'ine dönüştür
-                    bwa_data_json = self.bwa_parser.bwa_data.to_json(orient='split')
-                    
-                    # Yeni geçmiş kaydını oluştur
-                    new_entry = {
-                        "date": datetime.now().strftime("%Y-%m-%d %H:%M"), # Daha okunaklı tarih
-                        "file_name": os.path.basename(file_path),
-                        "bwa_data_json": bwa_data_json,
-                        "customer_info": self.bwa_parser.customer_info # Müşteri bilgisini de sakla
-                    }
-                    
-                    # Müşterinin geçmiş listesine ekle
-                    self.current_customer.bwa_upload_history.append(new_entry)
-                    self.customer_manager.save_customer(self.current_customer)
+                    # Veri anlık görüntü deposuna (ikili biçim), geçmişe sadece meta veri + hash
+                    self.customer_manager.add_bwa_upload(
+                        self.current_customer, os.path.basename(file_path), self.bwa_parser.bwa_data, self.bwa_parser.customer_info
+                    )
                     self.display_bwa_history() # Geçmiş listesini yenile
                 # --- GÜNCELLENMİŞ BÖLÜM SONU ---
                     
@@ -1101,10 +3051,8 @@ class EKSFormFiller(ctk.CTk):
                 widget.destroy()
 
             if self.current_customer and self.current_customer.bwa_upload_history:
-                # Geçmişi tarihe göre ters sırala (en yeni en üstte)
-                sorted_history = sorted(self.current_customer.bwa_upload_history, key=lambda x: x['date'], reverse=True)
-                
-                for entry in sorted_history[:10]: # Son 10 kaydı göster
+                # Geçmiş eskiden yeniye sıralı tutulur; en yeni 10 kayıt sondan okunur (sıralama yok)
+                for entry in self.customer_manager.recent_uploads(self.current_customer, 10):
                     
                     # Her kayıt için bir ana çerçeve oluştur
                     entry_frame = ctk.CTkFrame(self.bwa_history_frame, fg_color="#3b3b3b")
@@ -1142,16 +3090,24 @@ class EKSFormFiller(ctk.CTk):
         """Geçmiş kayıttan bir BWA verisini yükler."""
         self.bwa_status_label.configure(text=self.texts["loading"])
         
-        # Kaydedilmiş JSON verisini ve müşteri bilgisini al
-        json_data = history_entry['bwa_data_json']
+        # Kaydedilmiş BWA verisini ve müşteri bilgisini al
         customer_info = history_entry['customer_info']
+        try:
+            bwa_data = self.customer_manager.load_bwa_snapshot(history_entry)
+        except Exception as e:
+            bwa_data = None
+            print(f"Snapshot could not be read: {e}")
         
         # Bu işlem çok hızlı olacağı için ayrı bir thread'e gerek yok
-        success, message = self.bwa_parser.load_data_from_json(json_data, customer_info)
+        if bwa_data is None:
+            success, message = False, "BWA-Daten für diesen Eintrag nicht gefunden"
+        else:
+            success, message = self.bwa_parser.load_data_from_snapshot(bwa_data, customer_info, history_entry.get('snapshot'))
         
         if success:
             # Artık bir dosya yoluna bağlı değiliz
             self.bwa_file_path = None 
+            self.manual_overrides = {}
             self.bwa_status_label.configure(text=f'✅ {self.texts["bwa_loaded_from_history"].format(file_name=history_entry["file_name"])}', text_color="green")
             self.mapping_btn.configure(state="normal")
             self.update_bwa_info()
@@ -1176,8 +3132,7 @@ class EKSFormFiller(ctk.CTk):
 
             if confirm:
                 try:
-                    self.current_customer.bwa_upload_history.remove(entry_to_delete)
-                    self.customer_manager.save_customer(self.current_customer)
+                    self.customer_manager.delete_bwa_upload(self.current_customer, entry_to_delete)
                     self.display_bwa_history()
                 except ValueError:
                     messagebox.showerror(self.texts["error"], self.texts["record_not_found_error"])
@@ -1242,37 +3197,13 @@ class EKSFormFiller(ctk.CTk):
             
             def mapping_thread():
                 try:
-                    # Temel eşleştirme
-                    extracted = self.bwa_parser.extract_values_for_period(
-                        self.selected_start_month, self.selected_end_month
-                    )
+                    def report_progress(fraction: float, text: str):
+                        self.after(0, lambda: progress_bar.set(fraction))
+                        self.after(0, lambda: progress_label.configure(text=text))
                     
-                    # Progress güncelle
-                    self.after(0, lambda: progress_bar.set(0.6))
-                    self.after(0, lambda: progress_label.configure(text="Claude AI Vorschläge werden abgerufen..."))
-                    
-                    # --- İYİLEŞTİRİLMİŞ BÖLÜM BAŞLANGICI ---
-                    # Claude API aktifse öneriler al
-                    if self.bwa_parser.claude_api and self.bwa_parser.claude_api.is_available():
-                        unmapped = self.bwa_parser._find_unmapped_accounts()
-                        if unmapped:
-                            print(f"Found {len(unmapped)} unmapped accounts, getting AI suggestions...")
-                            ai_suggestions = self.bwa_parser._get_ai_suggestions(unmapped)
-                            if ai_suggestions:
-                                extracted['_ai_suggestions'] = ai_suggestions
-                                print(f"Got {len(ai_suggestions)} AI suggestions")
-                            else:
-                                # AI'dan öneri gelmediyse (geçersiz anahtar vb.) durumu not et
-                                extracted['_ai_status'] = "AI önerileri alınamadı. API anahtarı geçersiz olabilir."
-                                print("No AI suggestions received (API key may be invalid)")
-                        else:
-                            # Eşleştirilecek yeni hesap bulunamadıysa durumu not et
-                            extracted['_ai_status'] = "Tüm hesaplar eşleştirilmiş görünüyor."
-                    else:
-                        # API hiç yapılandırılmadıysa durumu not et
-                        extracted['_ai_status'] = "Claude AI aktif değil. Ayarlardan API anahtarınızı girin."
-                        print("Claude API not configured or not available")
-                    # --- İYİLEŞTİRİLMİŞ BÖLÜM SONU ---
+                    extracted = self.bwa_parser.run_mapping(
+                        self.selected_start_month, self.selected_end_month, report_progress
+                    )
                     
                     # Progress tamamlandı
                     self.after(0, lambda: progress_bar.set(1.0))
@@ -1292,6 +3223,7 @@ class EKSFormFiller(ctk.CTk):
     
     def handle_mapping_complete(self, extracted_data: Dict):
         """Mapping tamamlandığında çağrılır"""
+        self.apply_manual_overrides(extracted_data)
         self.extracted_data = extracted_data
         self.mapping_btn.configure(text=self.texts["auto_mapping"], state="normal")
         
@@ -1313,6 +3245,8 @@ class EKSFormFiller(ctk.CTk):
             for widget in self.results_frame.winfo_children():
                 widget.destroy()
             self.total_labels = {}
+            self.result_rows = {}
+            self.ai_suggestion_frames = {}
             
             if not self.extracted_data or not any(self.extracted_data.values()):
                 ctk.CTkLabel(self.results_frame, text="Keine Ergebnisse").pack(pady=20)
@@ -1348,11 +3282,13 @@ class EKSFormFiller(ctk.CTk):
                 
                 # EKS Kodu ve Açıklama
                 ctk.CTkLabel(self.results_frame, text=field, font=ctk.CTkFont(weight="bold"), anchor="w").grid(row=row_index, column=0, sticky="w", padx=10, pady=8)
-                ctk.CTkLabel(self.results_frame, text=data['description'], anchor="w").grid(row=row_index, column=1, sticky="ew", padx=5)
+                description_label = ctk.CTkLabel(self.results_frame, text=data['description'], anchor="w")
+                description_label.grid(row=row_index, column=1, sticky="ew", padx=5)
 
                 # Aylık Değerler (Düzenlenebilir)
-                for i, value in enumerate(data['values']):
-                    EditableLabel(self.results_frame, row_index, i + 2, value, self.update_data_value)
+                value_labels = [EditableLabel(self.results_frame, row_index, i + 2, value, self.update_data_value)
+                                for i, value in enumerate(data['values'])]
+                self.result_rows[field] = {'description': description_label, 'values': value_labels}
 
                 # Toplam
                 total = data.get('total', 0)
@@ -1391,6 +3327,7 @@ class EKSFormFiller(ctk.CTk):
         for suggestion in suggestions:
             suggestion_frame = ctk.CTkFrame(self.results_frame, fg_color="#2d4a2d")
             suggestion_frame.pack(fill="x", pady=5, padx=10)
+            self.ai_suggestion_frames[suggestion['bwa_account']] = suggestion_frame
             
             # Header
             header_text = f"BWA {suggestion['bwa_account']}: {suggestion['bwa_description'][:50]}..."
@@ -1399,7 +3336,8 @@ class EKSFormFiller(ctk.CTk):
             header_label.pack(anchor="w", padx=10, pady=5)
             
             # Vorschlag
-            suggestion_text = f"➜ {suggestion['suggested_eks']} (Vertrauen: {suggestion['confidence']}%)"
+            source_text = " · lokal" if suggestion.get('source') == 'local' else ""
+            suggestion_text = f"➜ {suggestion['suggested_eks']} (Vertrauen: {suggestion['confidence']}%{source_text})"
             suggestion_label = ctk.CTkLabel(suggestion_frame, text=suggestion_text, 
                                           text_color="#90EE90")
             suggestion_label.pack(anchor="w", padx=20, pady=2)
@@ -1431,16 +3369,15 @@ class EKSFormFiller(ctk.CTk):
     def accept_ai_suggestion(self, suggestion: Dict):
         """AI önerisini kabul et"""
         try:
-            new_rule = MappingRule(
+            # Hesap alanın mevcut kuralına eklenir (kural değiştirilmez, dosyaya yazılmaz)
+            changed_fields = self.bwa_parser.add_account_to_rule(
                 suggestion['suggested_eks'],
                 suggestion['bwa_account'],
-                "direct",
-                [suggestion['bwa_account']],
                 suggestion['bwa_description'][:30]
             )
-            
-            self.bwa_parser.mapping_rules[suggestion['suggested_eks']] = new_rule
-            self.perform_mapping()
+            self.bwa_parser.local_suggester.remember(
+                suggestion['bwa_account'], suggestion['bwa_description'], suggestion['suggested_eks'])
+            self.update_mapping_fields(changed_fields, accepted_suggestion=suggestion)
             
             messagebox.showinfo("AI Vorschlag", 
                 f"Zuordnung {suggestion['bwa_account']} → {suggestion['suggested_eks']} wurde hinzugefügt!")
@@ -1448,6 +3385,81 @@ class EKSFormFiller(ctk.CTk):
         except Exception as e:
             messagebox.showerror("Fehler", f"Fehler beim Hinzufügen der Zuordnung: {e}")
     
+    def update_mapping_fields(self, fields: List[str], accepted_suggestion: Optional[Dict] = None):
+        """Artımlı eşleştirme: sadece değişen alanları yeniden hesaplar.
+        
+        Diğer alanlar, AI önerileri ve tablo satırları korunur; AI tekrar çağrılmaz.
+        """
+        if not any(not key.startswith('_') for key in self.extracted_data):
+            # Henüz tam bir eşleştirme yok
+            self.perform_mapping()
+            return
+        
+        # Mevcut sonuçlarla aynı dönemi kullan
+        months = next((data.get('months', []) for key, data in self.extracted_data.items()
+                       if not key.startswith('_')), [])
+        if months:
+            start_month, end_month = months[0], months[-1]
+        else:
+            start_month, end_month = self.selected_start_month, self.selected_end_month
+        
+        updated = self.bwa_parser.thaw_results(
+            self.bwa_parser.extract_values_for_period(start_month, end_month, fields=fields))
+        self.apply_manual_overrides(updated)
+        new_fields = [field for field in updated if field not in self.extracted_data]
+        self.extracted_data.update(updated)
+        
+        if accepted_suggestion is not None:
+            account = accepted_suggestion['bwa_account']
+            remaining = [s for s in self.extracted_data.get('_ai_suggestions', []) if s['bwa_account'] != account]
+            if remaining:
+                self.extracted_data['_ai_suggestions'] = remaining
+            else:
+                self.extracted_data.pop('_ai_suggestions', None)
+            frame = self.ai_suggestion_frames.pop(account, None)
+            if frame is not None:
+                frame.destroy()
+        
+        for field in updated:
+            print(f"Incremental mapping: {field} <- rows {self.bwa_parser.get_field_dependencies(field)['rows']}")
+        
+        # Yeni alan tabloya satır ekler; sıralama değiştiği için tablo yeniden çizilir
+        if new_fields or any(field not in self.result_rows for field in updated):
+            self.display_mapping_results()
+            return
+        
+        for field, data in updated.items():
+            row = self.result_rows[field]
+            row['description'].configure(text=data['description'])
+            for label, value in zip(row['values'], data['values']):
+                label.update_text(value)
+            self.total_labels[field].update_text(data['total'])
+    
+    def open_rule_dialog(self):
+        """Hesap aralığı/önek kuralı ekler veya alanı varsayılana döndürür; kural kaydedilir ve
+        yüklü BWA'da sadece o alan yeniden hesaplanır"""
+        dialog = MappingRuleDialog(self, self.texts, self.bwa_parser.mapping_rules)
+        self.wait_window(dialog)
+        if dialog.reset_field is not None:
+            changed_fields = self.bwa_parser.reset_mapping_rules([dialog.reset_field])
+        elif dialog.result is not None:
+            changed_fields = self.bwa_parser.set_account_ranges(
+                dialog.result.eks_field, dialog.result.account_ranges, dialog.result.account_prefixes)
+        else:
+            return
+        self.bwa_parser.save_mapping_rules()
+        
+        if self.bwa_parser.bwa_data is not None and any(not key.startswith('_') for key in self.extracted_data):
+            # Varsayılanı olmayan alan silindiyse satırı da tablodan kalkar
+            removed = [field for field in changed_fields if field not in self.bwa_parser.mapping_rules]
+            for field in removed:
+                self.extracted_data.pop(field, None)
+            kept = [field for field in changed_fields if field in self.bwa_parser.mapping_rules]
+            if kept:
+                self.update_mapping_fields(kept)
+            if removed:
+                self.display_mapping_results()
+    
     def ignore_ai_suggestion(self, suggestion: Dict):
         """AI önerisini görmezden gel"""
         pass
@@ -1927,8 +3939,7 @@ Konsol çıktısını kontrol edin."""
                 "confidence": self.calculate_average_confidence()
             }
             
-            self.current_customer.bwa_history.append(history_entry)
-            self.customer_manager.save_customer(self.current_customer)
+            self.customer_manager.add_export(self.current_customer, history_entry)
     
     def calculate_average_confidence(self) -> float:
         if not self.extracted_data:
@@ -1937,14 +3948,30 @@ Konsol çıktısını kontrol edin."""
         confidences = [data.get('confidence', 0) for field, data in self.extracted_data.items() if not field.startswith('_')]
         return sum(confidences) / len(confidences) if confidences else 0.0
     
+    def apply_manual_overrides(self, results: Dict):
+        """Elle düzeltilen ay değerlerini yeniden hesaplanan sonuçlara yazar ve toplamları günceller"""
+        for field_key, overrides in self.manual_overrides.items():
+            data = results.get(field_key)
+            if not data:
+                continue
+            changed = False
+            for i, month in enumerate(data.get('months', [])):
+                if month in overrides:
+                    data['values'][i] = overrides[month]
+                    changed = True
+            if changed:
+                data['total'] = sum(v for v in data['values'] if v is not None)
+    
     def update_data_value(self, data_row_index: int, month_index: int, new_value: float):
             """EditableLabel'dan gelen geri bildirimi işler ve veriyi günceller."""
             # Hangi EKS alanının güncellendiğini bul
             fields = sorted([k for k in self.extracted_data.keys() if not k.startswith('_')])
             field_key = fields[data_row_index - 1] # -1 çünkü başlık satırı var
             
-            # Arka plan verisini güncelle
+            # Arka plan verisini güncelle; düzeltme ay adıyla saklanır (dönem değişince yeniden uygulanır)
             self.extracted_data[field_key]['values'][month_index] = new_value
+            month = self.extracted_data[field_key]['months'][month_index]
+            self.manual_overrides.setdefault(field_key, {})[month] = new_value
             
             # Satır toplamını yeniden hesapla
             new_total = sum(v for v in self.extracted_data[field_key]['values'] if v is not None)
@@ -2031,6 +4058,135 @@ class CustomerDialog(ctk.CTkToplevel):
         self.destroy()
 
 
+class MappingRuleDialog(ctk.CTkToplevel):
+    """Bir EKS alanına hesap aralığı / hesap öneki kuralı ekler veya değiştirir"""
+    
+    def __init__(self, parent, texts, rules: Dict[str, MappingRule]):
+        super().__init__(parent)
+        
+        self.texts = texts
+        self.rules = rules
+        self.result = None
+        self.reset_field = None  # "Standard" ile varsayılana döndürülecek alan
+        
+        self.title("Kontenbereich-Regel")
+        self.geometry("460x320")
+        self.configure(fg_color="#2b2b2b")
+        
+        self.transient(parent)
+        self.grab_set()
+        
+        self.setup_ui()
+        self.center_window()
+    
+    def setup_ui(self):
+        main_frame = ctk.CTkFrame(self, fg_color="transparent")
+        main_frame.pack(fill="both", expand=True, padx=20, pady=20)
+        
+        title_label = ctk.CTkLabel(main_frame, text="Kontenbereich-Regel",
+                                 font=ctk.CTkFont(size=18, weight="bold"))
+        title_label.pack(pady=10)
+        
+        field_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        field_frame.pack(fill="x", pady=8)
+        ctk.CTkLabel(field_frame, text="EKS-Feld:", width=120, anchor="w").pack(side="left")
+        self.field_combo = ctk.CTkComboBox(field_frame, values=sorted(self.rules), width=220,
+                                          command=self.on_field_selected)
+        self.field_combo.pack(side="right")
+        
+        range_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        range_frame.pack(fill="x", pady=8)
+        ctk.CTkLabel(range_frame, text="Kontenbereiche:", width=120, anchor="w").pack(side="left")
+        self.range_entry = ctk.CTkEntry(range_frame, width=220, placeholder_text="6300-6399, 6800")
+        self.range_entry.pack(side="right")
+        
+        prefix_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        prefix_frame.pack(fill="x", pady=8)
+        ctk.CTkLabel(prefix_frame, text="Kontenpräfixe:", width=120, anchor="w").pack(side="left")
+        self.prefix_entry = ctk.CTkEntry(prefix_frame, width=220, placeholder_text="63, 68")
+        self.prefix_entry.pack(side="right")
+        
+        button_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        button_frame.pack(side="bottom", pady=10)
+        
+        cancel_btn = ctk.CTkButton(button_frame, text="Abbrechen", command=self.cancel, width=100)
+        cancel_btn.pack(side="left", padx=10)
+        
+        reset_btn = ctk.CTkButton(button_frame, text="Standard", command=self.reset, width=100, fg_color="gray")
+        reset_btn.pack(side="left", padx=10)
+        
+        save_btn = ctk.CTkButton(button_frame, text="Speichern", command=self.save, width=100)
+        save_btn.pack(side="right", padx=10)
+        
+        if self.rules:
+            first_field = sorted(self.rules)[0]
+            self.field_combo.set(first_field)
+            self.on_field_selected(first_field)
+    
+    def center_window(self):
+        self.update_idletasks()
+        x = (self.winfo_screenwidth() // 2) - (460 // 2)
+        y = (self.winfo_screenheight() // 2) - (320 // 2)
+        self.geometry(f"460x320+{x}+{y}")
+    
+    def on_field_selected(self, eks_field: str):
+        """Seçilen alanın mevcut aralık/önek kurallarını giriş alanlarına yazar"""
+        rule = self.rules.get(eks_field)
+        self.range_entry.delete(0, "end")
+        self.prefix_entry.delete(0, "end")
+        if rule is None:
+            return
+        ranges = [low if low == high else f"{low}-{high}" for low, high in rule.account_ranges or []]
+        if ranges:
+            self.range_entry.insert(0, ", ".join(ranges))
+        if rule.account_prefixes:
+            self.prefix_entry.insert(0, ", ".join(rule.account_prefixes))
+    
+    @staticmethod
+    def parse_ranges(text: str) -> List[Tuple[str, str]]:
+        """"6300-6399, 6800" -> [("6300", "6399"), ("6800", "6800")]"""
+        ranges = []
+        for part in text.split(','):
+            part = part.strip()
+            if part:
+                low, _, high = part.partition('-')
+                ranges.append((low.strip(), (high or low).strip()))
+        return ranges
+    
+    def save(self):
+        eks_field = self.field_combo.get().strip()
+        if not eks_field:
+            messagebox.showwarning("Warnung", "Bitte ein EKS-Feld auswählen")
+            return
+        
+        ranges = self.parse_ranges(self.range_entry.get())
+        prefixes = [prefix.strip() for prefix in self.prefix_entry.get().split(',') if prefix.strip()]
+        try:
+            existing = self.rules.get(eks_field)
+            if existing is not None:
+                self.result = replace(existing, account_ranges=ranges, account_prefixes=prefixes)
+            else:
+                self.result = MappingRule(eks_field, "Kontenbereich", "sum", [], eks_field,
+                                          account_ranges=ranges, account_prefixes=prefixes)
+        except ValueError as e:
+            messagebox.showwarning("Warnung", str(e))
+            return
+        self.destroy()
+    
+    def reset(self):
+        """Seçilen alanın kuralını varsayılana döndürür (kaydedilmiş kural silinir)"""
+        eks_field = self.field_combo.get().strip()
+        if not eks_field:
+            return
+        if messagebox.askyesno("Standard wiederherstellen",
+                               f"Zuordnung für {eks_field} auf den Standard zurücksetzen?"):
+            self.reset_field = eks_field
+            self.destroy()
+    
+    def cancel(self):
+        self.destroy()
+
+
 class SettingsDialog(ctk.CTkToplevel):
     def __init__(self, parent, texts):
         super().__init__(parent)
@@ -2192,11 +4348,14 @@ class SettingsDialog(ctk.CTkToplevel):
                     ]
                 }
                 
-                response = requests.post(
-                    "https://api.anthropic.com/v1/messages",
+                # Bağlantı testi: tek yeniden deneme, uzun bekleme yok
+                response = ClaudeHTTPClient.shared().post(
+                    self.settings.get("claude_api_url") or DEFAULT_CLAUDE_API_URL,
                     headers=headers,
                     json=data,
-                    timeout=10
+                    timeout=10,
+                    max_retries=1,
+                    max_total=20
                 )
                 
                 self.after(0, lambda: progress_bar.stop())
@@ -2252,7 +4411,7 @@ class SettingsDialog(ctk.CTkToplevel):
         if self.save_settings():
             # Ana penceredeki API'yi güncelle
             if hasattr(self.master, 'bwa_parser'):
-                self.master.bwa_parser.set_claude_api(api_key)
+                self.master.bwa_parser.set_claude_api(api_key, self.settings.get("claude_api_url"))
             messagebox.showinfo("Erfolg", "Einstellungen gespeichert")
             self.destroy()
         else:
@@ -2373,8 +4532,8 @@ class EditableLabel:
 
     def update_text(self, new_value):
         """Dışarıdan değeri güncellemek için kullanılır."""
-        self.value = new_value
-        self.label.configure(text=f"{self.value:,.2f} €")
+        self.value = new_value if isinstance(new_value, (int, float)) else 0.0
+        self.label.configure(text=f"{self.value:,.2f} €" if new_value is not None else "N/A")
 
 
 # Hauptprogramm
@@ -0,0 +1,177 @@
+# mock_claude_server.py
+# Claude Messages API (/v1/messages) yerine geçen yerel test sunucusu.
+# AI öneri yolunu gerçek API'ye gitmeden ölçmek için: gecikme, hata oranı ve 429 enjeksiyonu ayarlanabilir.
+#
+# Kullanım:
+#   python mock_claude_server.py --port 8765 --latency 0.8 --jitter 0.3 --error-rate 0.05 --rate-429 0.1
+# settings.json içinde:  "claude_api_url": "http://127.0.0.1:8765/v1/messages"
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+EKS_FIELDS = ["A1", "A5", "A7", "B1", "B2c", "B3", "B10", "B11", "B14c", "B14e", "B14f", "B14h", "B17", "B18"]
+
+# Açıklamadaki anahtar kelimeye göre makul bir alan; yoksa hesap koduna göre sabit (deterministik) bir alan
+KEYWORD_FIELDS = [
+    ("erlös", "A1"), ("umsatzsteuer", "A5"), ("wareneingang", "B1"), ("aushilf", "B2c"),
+    ("miete", "B3"), ("strom", "B3"), ("büro", "B10"), ("porto", "B10"), ("telefon", "B11"),
+    ("geldverkehr", "B14c"), ("reinigung", "B14e"), ("bewirtung", "B14f"), ("vorsteuer", "B17"),
+]
+
+
+class MockSettings:
+    def __init__(self, latency: float = 0.5, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_429: float = 0.0, retry_after: float = 1.0, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "accounts": 0}
+
+
+def suggest_field(account: str, description: str) -> str:
+    text = description.casefold()
+    for keyword, field in KEYWORD_FIELDS:
+        if keyword in text:
+            return field
+    digest = int(hashlib.sha256(account.encode("utf-8")).hexdigest(), 16)
+    return EKS_FIELDS[digest % len(EKS_FIELDS)]
+
+
+def answer_prompt(prompt: str) -> Tuple[str, int]:
+    """ClaudeAPIHelper istemlerine aynı biçimde cevap üretir; (metin, hesap sayısı)"""
+    batch_lines = re.findall(r'^- Konto: (.+?) \| Beschreibung: (.*?) \| Monatswerte:', prompt, re.MULTILINE)
+    if batch_lines:
+        answer = [{"account": account.strip(), "suggestion": suggest_field(account.strip(), description),
+                   "confidence": 80, "reason": "Mock-Antwort"} for account, description in batch_lines]
+        return json.dumps(answer, ensure_ascii=False), len(batch_lines)
+
+    account_match = re.search(r'BWA Hesap Kodu: (.*)', prompt)
+    description_match = re.search(r'Beschreibung: (.*)', prompt)
+    account = account_match.group(1).strip() if account_match else ""
+    description = description_match.group(1).strip() if description_match else ""
+    answer = {"suggestion": suggest_field(account, description), "confidence": 80, "reason": "Mock-Antwort"}
+    return json.dumps(answer, ensure_ascii=False), 1
+
+
+def make_handler(settings: MockSettings):
+    class MockClaudeHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict, headers: dict = None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                with settings.lock:
+                    self._send_json(200, dict(settings.stats))
+            else:
+                self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": "Not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw_body = self.rfile.read(length)
+            if self.path != "/v1/messages":
+                self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": "Not found"}})
+                return
+            if not self.headers.get("x-api-key"):
+                self._send_json(401, {"type": "error", "error": {"type": "authentication_error", "message": "invalid x-api-key"}})
+                return
+
+            with settings.lock:
+                settings.stats["requests"] += 1
+                roll = settings.random.random()
+                delay = max(0.0, settings.latency + settings.random.uniform(-settings.jitter, settings.jitter))
+
+            if roll < settings.rate_429:
+                with settings.lock:
+                    settings.stats["rate_limited"] += 1
+                self._send_json(429, {"type": "error", "error": {"type": "rate_limit_error", "message": "Rate limit exceeded"}},
+                                {"retry-after": str(settings.retry_after)})
+                return
+
+            time.sleep(delay)
+            if roll < settings.rate_429 + settings.error_rate:
+                with settings.lock:
+                    settings.stats["errors"] += 1
+                self._send_json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+                return
+
+            try:
+                request = json.loads(raw_body.decode("utf-8"))
+                prompt = request["messages"][0]["content"]
+            except (ValueError, KeyError, IndexError):
+                self._send_json(400, {"type": "error", "error": {"type": "invalid_request_error", "message": "Invalid body"}})
+                return
+
+            text, accounts = answer_prompt(prompt)
+            with settings.lock:
+                settings.stats["ok"] += 1
+                settings.stats["accounts"] += accounts
+            self._send_json(200, {
+                "id": f"msg_mock_{settings.stats['requests']}",
+                "type": "message",
+                "role": "assistant",
+                "model": request.get("model", "mock"),
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4}
+            })
+
+    return MockClaudeHandler
+
+
+def start_server(port: int = 8765, settings: MockSettings = None, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Sunucuyu arka plan thread'inde başlatır (benchmark_mapping.py için); server.shutdown() ile durdurulur"""
+    server = ThreadingHTTPServer((host, port), make_handler(settings or MockSettings()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Claude /v1/messages için yerel test sunucusu")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Ortalama cevap süresi (saniye)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Gecikmeye eklenen +/- rastgele sapma (saniye)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="529 Overloaded cevabı oranı (0-1)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="429 Rate limit cevabı oranı (0-1)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 cevaplarındaki retry-after (saniye)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency, args.jitter, args.error_rate, args.rate_429, args.retry_after, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(settings))
+    server.daemon_threads = True
+    print(f"Mock Claude API: http://{args.host}:{args.port}/v1/messages (Statistik: /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Statistik: {settings.stats}")
+
+
+if __name__ == "__main__":
+    main()